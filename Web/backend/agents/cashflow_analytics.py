@@ -0,0 +1,175 @@
+import os
+import re
+import numpy as np
+
+# Months in each rolling average
+CASHFLOW_ROLLING_WINDOW = int(os.getenv("CASHFLOW_ROLLING_WINDOW", "3"))
+# Months listed in the best/worst rankings
+CASHFLOW_TOP_N = int(os.getenv("CASHFLOW_TOP_N", "3"))
+
+
+def parse_number(value):
+    """Parse 50000, "50000" or "₹50,000"; None when empty or not a number"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = re.sub(r"[^0-9.\-]", "", str(value))
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def cashflow_arrays(data: dict) -> dict:
+    """
+    Turns data["cashflowData"] rows ({month, income, expenses, net}) into
+    columnar arrays. Amounts may be formatted strings such as "₹45,000";
+    unparseable amounts count as 0, and `net` is derived from
+    income - expenses where missing.
+    """
+    rows = [row for row in data.get("cashflowData") or [] if isinstance(row, dict)]
+    months = [str(row.get("month", i + 1)) for i, row in enumerate(rows)]
+    income = np.array([parse_number(row.get("income")) or 0.0 for row in rows])
+    expenses = np.array([parse_number(row.get("expenses")) or 0.0 for row in rows])
+    net = np.array([parse_number(row.get("net")) for row in rows], dtype=float)
+    net = np.where(np.isnan(net), income - expenses, net)
+    return {"months": months, "income": income, "expenses": expenses, "net": net}
+
+
+def _value(x):
+    """JSON-safe rounded float; NaN and infinity become None"""
+    x = float(x)
+    return round(x, 2) if np.isfinite(x) else None
+
+
+def _values(array):
+    return [_value(x) for x in array]
+
+
+def _growth(array):
+    """Period-over-period growth in percent; undefined where the base is zero"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(array[:-1] != 0, np.diff(array) / np.abs(array[:-1]) * 100, np.nan)
+
+
+def _rolling_mean(array, window):
+    if len(array) < window:
+        return np.array([])
+    cumsum = np.cumsum(np.insert(array, 0, 0.0))
+    return (cumsum[window:] - cumsum[:-window]) / window
+
+
+def cashflow_metrics(data: dict, window: int = CASHFLOW_ROLLING_WINDOW, top_n: int = CASHFLOW_TOP_N) -> dict:
+    """
+    Computes trend, growth, ranking, break-even and runway metrics for
+    data["cashflowData"] in one vectorized pass. `data["cashBalance"]`, if
+    present, is used for the runway. Returns None when there are no rows.
+    """
+    arrays = cashflow_arrays(data)
+    months, income, expenses, net = arrays["months"], arrays["income"], arrays["expenses"], arrays["net"]
+    count = len(months)
+    if count == 0:
+        return None
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margin = np.where(income != 0, net / income * 100, np.nan)
+        compound_growth = (
+            ((income[-1] / income[0]) ** (1 / (count - 1)) - 1) * 100
+            if count > 1 and income[0] > 0 and income[-1] > 0 else np.nan
+        )
+    cumulative = np.cumsum(net)
+    order = np.argsort(net, kind="stable")
+
+    # Break-even: the income that would cover average expenses, and the first
+    # month in which cumulative net turns non-negative after being negative
+    negative = np.flatnonzero(cumulative < 0)
+    recovered = np.flatnonzero((cumulative >= 0) & (np.arange(count) > negative[0])) if len(negative) else []
+    average_net = net.mean()
+    burn_rate = -average_net if average_net < 0 else 0.0
+    cash_balance = parse_number(data.get("cashBalance"))
+    if burn_rate and cash_balance is not None:
+        runway = cash_balance / burn_rate
+    else:
+        runway = None
+
+    return {
+        "months": count,
+        "period": f"{months[0]} to {months[-1]}",
+        "totals": {"income": _value(income.sum()), "expenses": _value(expenses.sum()), "net": _value(net.sum())},
+        "averages": {"income": _value(income.mean()), "expenses": _value(expenses.mean()), "net": _value(average_net)},
+        "margin_pct": {
+            "by_month": _values(margin),
+            "average": _value(np.nanmean(margin)) if np.isfinite(margin).any() else None,
+        },
+        "rolling_average": {
+            "window": window,
+            "income": _values(_rolling_mean(income, window)),
+            "expenses": _values(_rolling_mean(expenses, window)),
+            "net": _values(_rolling_mean(net, window)),
+        },
+        "growth_pct": {
+            "income_mom": _values(_growth(income)),
+            "expenses_mom": _values(_growth(expenses)),
+            "net_mom": _values(_growth(net)),
+            "income_compound_monthly": _value(compound_growth),
+            "income_yoy": _value(_growth(income[[-13, -1]])[0]) if count >= 13 else None,
+            "net_yoy": _value(_growth(net[[-13, -1]])[0]) if count >= 13 else None,
+        },
+        "volatility": {
+            "net_std": _value(net.std()),
+            "net_cv": _value(net.std() / abs(average_net)) if average_net else None,
+        },
+        "best_months": [{"month": months[i], "net": _value(net[i])} for i in np.argsort(-net, kind="stable")[:top_n]],
+        "worst_months": [{"month": months[i], "net": _value(net[i])} for i in order[:top_n]],
+        "loss_months": [months[i] for i in np.flatnonzero(net < 0)],
+        "break_even": {
+            "required_monthly_income": _value(expenses.mean()),
+            "margin_of_safety_pct": (
+                _value((income.mean() - expenses.mean()) / income.mean() * 100) if income.mean() else None
+            ),
+            "cumulative_recovery_month": months[recovered[0]] if len(recovered) else None,
+        },
+        "burn_rate": _value(burn_rate),
+        "runway_months": _value(runway) if runway is not None else None,
+    }
+
+
+def _pct(value):
+    return f"{value}%" if value is not None else "n/a"
+
+
+def _ranked(entries):
+    return ", ".join(f"{entry['month']} (₹{entry['net']})" for entry in entries)
+
+
+def cashflow_facts(metrics: dict) -> str:
+    """
+    Renders the headline metrics as short lines for an LLM prompt.
+    """
+    if not metrics:
+        return "No cashflow data available."
+    growth = metrics["growth_pct"]
+    last_growth = growth["income_mom"][-1] if growth["income_mom"] else None
+    lines = [
+        f"Period: {metrics['period']} ({metrics['months']} months)",
+        f"Totals: income ₹{metrics['totals']['income']}, expenses ₹{metrics['totals']['expenses']}, "
+        f"net ₹{metrics['totals']['net']}",
+        f"Monthly averages: income ₹{metrics['averages']['income']}, expenses ₹{metrics['averages']['expenses']}, "
+        f"net ₹{metrics['averages']['net']}, margin {_pct(metrics['margin_pct']['average'])}",
+        f"Latest income MoM growth: {_pct(last_growth)}; compound monthly income growth: "
+        f"{_pct(growth['income_compound_monthly'])}",
+        f"Best months by net: {_ranked(metrics['best_months'])}",
+        f"Worst months by net: {_ranked(metrics['worst_months'])}",
+        f"Loss-making months: {', '.join(metrics['loss_months']) or 'none'}",
+        f"Break-even monthly income: ₹{metrics['break_even']['required_monthly_income']}; "
+        f"margin of safety {_pct(metrics['break_even']['margin_of_safety_pct'])}",
+        f"Net volatility (std): ₹{metrics['volatility']['net_std']}",
+    ]
+    if growth["income_yoy"] is not None:
+        lines.append(f"Income YoY growth: {_pct(growth['income_yoy'])}")
+    if metrics["burn_rate"]:
+        runway = metrics["runway_months"]
+        runway = f"{runway} months" if runway is not None else "unknown (no cashBalance)"
+        lines.append(f"Burn rate: ₹{metrics['burn_rate']}/month; runway: {runway}")
+    return "\n".join(lines)
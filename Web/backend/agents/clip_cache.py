@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+
+# Total bytes of stock clips kept on disk before least-recently-used ones are evicted
+CLIP_CACHE_MAX_BYTES = int(os.getenv("CLIP_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Clips used more recently than this are never evicted, so a render in progress
+# does not lose its source files
+CLIP_CACHE_MIN_AGE = float(os.getenv("CLIP_CACHE_MIN_AGE", "3600"))
+# Re-hash cached clips on every hit (size is always checked)
+CLIP_CACHE_VERIFY = os.getenv("CLIP_CACHE_VERIFY", "0") == "1"
+# How long Pexels search results are reused
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(24 * 3600)))
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ClipCache:
+    """
+    Content-addressed on-disk cache for Pexels clips and search results.
+
+    Clips are keyed by Pexels video id + file link and stored as
+    <root>/clips/<key>.mp4. Writes go to a temporary file that is renamed into
+    place, so readers never see a partial clip.
+    """
+
+    def __init__(self, root, max_bytes=CLIP_CACHE_MAX_BYTES):
+        self.root = root
+        self.clips_dir = os.path.join(root, "clips")
+        self.max_bytes = max_bytes
+        os.makedirs(self.clips_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "clip_cache.db"), timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS clips ("
+            "key TEXT PRIMARY KEY, path TEXT, size INTEGER, sha256 TEXT, last_used REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS searches ("
+            "key TEXT PRIMARY KEY, results TEXT, expires_at REAL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def clip_key(video_id, url):
+        return hashlib.sha256(f"{video_id}|{url}".encode("utf-8")).hexdigest()
+
+    def _drop(self, key, path):
+        self._db.execute("DELETE FROM clips WHERE key = ?", (key,))
+        self._db.commit()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def get_clip(self, video_id, url):
+        """
+        Returns the cached path for a clip, or None if missing or corrupt.
+        """
+        key = self.clip_key(video_id, url)
+        with self._lock:
+            row = self._db.execute("SELECT path, size, sha256 FROM clips WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            path, size, sha256 = row
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                self._drop(key, path)
+                return None
+            if CLIP_CACHE_VERIFY and _sha256_file(path) != sha256:
+                self._drop(key, path)
+                return None
+            self._db.execute("UPDATE clips SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return path
+
+    def fetch_clip(self, video_id, url, download):
+        """
+        Returns a local path for the clip, calling download(url, path) on a miss.
+        Returns None if the download fails.
+        """
+        cached = self.get_clip(video_id, url)
+        if cached:
+            return cached
+
+        key = self.clip_key(video_id, url)
+        path = os.path.join(self.clips_dir, f"{key}.mp4")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            if not download(url, tmp_path) or os.path.getsize(tmp_path) == 0:
+                return None
+            size = os.path.getsize(tmp_path)
+            sha256 = _sha256_file(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO clips (key, path, size, sha256, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, path, size, sha256, time.time()),
+            )
+            self._db.commit()
+            self._evict()
+        return path
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM clips").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        cutoff = time.time() - CLIP_CACHE_MIN_AGE
+        rows = self._db.execute(
+            "SELECT key, path, size FROM clips WHERE last_used < ? ORDER BY last_used", (cutoff,)
+        ).fetchall()
+        for key, path, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._drop(key, path)
+            total -= size
+
+    def get_search(self, query, orientation, count):
+        """
+        Returns cached search results, or None if missing or expired.
+        """
+        key = f"{query.strip().lower()}|{orientation}|{count}"
+        with self._lock:
+            row = self._db.execute("SELECT results, expires_at FROM searches WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def put_search(self, query, orientation, count, results):
+        key = f"{query.strip().lower()}|{orientation}|{count}"
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO searches (key, results, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(results), time.time() + SEARCH_CACHE_TTL),
+            )
+            self._db.execute("DELETE FROM searches WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
@@ -0,0 +1,426 @@
+import os
+import re
+import json
+import math
+import uuid
+import shutil
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from agents.workspace import evict_lru
+
+
+def _default_ffmpeg():
+    """System ffmpeg if there is one, else the binary bundled with MoviePy's imageio-ffmpeg"""
+    if shutil.which("ffmpeg"):
+        return "ffmpeg"
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN") or _default_ffmpeg()
+# imageio-ffmpeg ships no ffprobe; without one, durations are read through FFMPEG_BIN
+FFPROBE_BIN = os.getenv("FFPROBE_BIN") or shutil.which("ffprobe")
+# 0 lets ffmpeg/x264 pick the thread count
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", "0"))
+X264_PRESET = os.getenv("X264_PRESET", "medium")
+# Segments rendered at once by render_reel_parallel
+VIDEO_RENDER_WORKERS = int(os.getenv("VIDEO_RENDER_WORKERS", str(os.cpu_count() or 2)))
+
+AUDIO_RATE = 44100
+
+# Encoded segments kept for incremental re-renders
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv("SEGMENT_CACHE_MAX_BYTES", str(1024 ** 3)))
+# Segments touched more recently than this may belong to a render in progress
+SEGMENT_CACHE_MIN_AGE = float(os.getenv("SEGMENT_CACHE_MIN_AGE", "600"))
+
+# Output geometry and encoder settings; see RENDER_PROFILES in video_generation_agent
+DEFAULT_PROFILE = {"width": 1080, "height": 1920, "fps": 30, "preset": X264_PRESET, "crf": 23, "bitrate": None}
+
+
+def ffmpeg_available():
+    """True when FFMPEG_BIN resolves to an executable"""
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+def probe_duration(path):
+    """Return the container duration of a media file in seconds"""
+    if FFPROBE_BIN:
+        result = subprocess.run(
+            [FFPROBE_BIN, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+            capture_output=True, text=True, check=True
+        )
+        return float(result.stdout.strip())
+    # ffmpeg with no output file prints the input header and exits non-zero
+    result = subprocess.run([FFMPEG_BIN, "-hide_banner", "-i", path], capture_output=True, text=True)
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        raise ValueError(f"Could not read the duration of {path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def gradient_png(path, width, height):
+    """Write the vertical grey gradient used behind the CTA card"""
+    if not os.path.exists(path):
+        pixels = np.tile(np.linspace(50, 150, height).reshape(height, 1, 1), (1, width, 3)).astype('uint8')
+        Image.fromarray(pixels).save(path)
+    return path
+
+
+def _run(args):
+    result = subprocess.run(args, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {result.stderr[-2000:]}")
+
+
+def build_filter_graph(segments, cta, width, height, fps):
+    """Express a whole reel as ffmpeg input arguments plus one filter graph.
+
+    Each segment is a dict with `source`, `start`, `duration`, `overlay`
+    (caption PNG), `overlay_xy` and `audio` (voiceover path or None). `cta` is
+    a dict with `background`, `duration`, `overlay`, `overlay_xy` and `audio`,
+    or None. Returns (input_args, filter_graph, video_label, audio_label).
+    """
+    inputs, graph, videos, audios = build_multi_filter_graph(segments, cta, [(width, height)], fps)
+    return inputs, graph, videos[0], audios[0]
+
+
+def build_multi_filter_graph(segments, cta, frames, fps):
+    """Like build_filter_graph, but for several frame sizes at once.
+
+    Every source is decoded once and split into one scale/crop/pad chain per
+    (width, height) in `frames`; the audio is mixed once and split. Segments
+    and the CTA may carry `overlays`, a list of (caption PNG, xy) per frame,
+    instead of `overlay`/`overlay_xy`.
+    Returns (input_args, filter_graph, video_labels, audio_labels).
+    """
+    inputs = []
+    filters = []
+    video_labels = [[] for _ in frames]
+    audio_labels = []
+
+    def add_input(*args):
+        inputs.extend(args)
+        return len([a for a in inputs if a == "-i"]) - 1
+
+    def add_audio(audio, duration, label):
+        if audio:
+            index = add_input("-i", audio)
+            filters.append(
+                f"[{index}:a]aresample={AUDIO_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo,"
+                f"apad,atrim=0:{duration:.3f},asetpts=PTS-STARTPTS[{label}]"
+            )
+        else:
+            filters.append(
+                f"anullsrc=r={AUDIO_RATE}:cl=stereo,atrim=0:{duration:.3f},asetpts=PTS-STARTPTS[{label}]"
+            )
+        audio_labels.append(f"[{label}]")
+
+    def add_caption(base, overlay, overlay_xy, label):
+        index = add_input("-i", overlay)
+        x, y = overlay_xy
+        filters.append(f"[{index}:v]format=rgba,colorchannelmixer=aa=0.95[cap_{label}]")
+        filters.append(f"[{base}][cap_{label}]overlay={x}:{y}:format=auto,format=yuv420p[{label}]")
+
+    def overlays(item):
+        return item.get("overlays") or [(item["overlay"], item["overlay_xy"])]
+
+    def split(source, prefix):
+        labels = [f"{prefix}_{k}" for k in range(len(frames))]
+        filters.append(f"{source}split={len(frames)}{''.join(f'[{label}]' for label in labels)}")
+        return labels
+
+    for i, segment in enumerate(segments):
+        duration = segment["duration"]
+        index = add_input("-ss", f"{segment['start']:.3f}", "-t", f"{duration:.3f}", "-i", segment["source"])
+        sources = split(f"[{index}:v]setsar=1,fps={fps},setpts=PTS-STARTPTS,", f"src{i}")
+        for k, ((width, height), (overlay, overlay_xy)) in enumerate(zip(frames, overlays(segment))):
+            # Scale to the target height, centre-crop anything wider than the
+            # frame and pad anything narrower, like the MoviePy path
+            filters.append(
+                f"[{sources[k]}]scale=-2:{height},crop='min(iw,{width})':{height},"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1[base{i}_{k}]"
+            )
+            add_caption(f"base{i}_{k}", overlay, overlay_xy, f"v{i}_{k}")
+            video_labels[k].append(f"[v{i}_{k}]")
+        add_audio(segment.get("audio"), duration, f"a{i}")
+
+    if cta is not None:
+        duration = cta["duration"]
+        index = add_input("-loop", "1", "-framerate", str(fps), "-t", f"{duration:.3f}", "-i", cta["background"])
+        # The background is a vertical gradient, so one image scales to every frame
+        sources = split(f"[{index}:v]", "ctasrc")
+        for k, ((width, height), (overlay, overlay_xy)) in enumerate(zip(frames, overlays(cta))):
+            filters.append(f"[{sources[k]}]scale={width}:{height},setsar=1,format=yuv420p[ctabase_{k}]")
+            add_caption(f"ctabase_{k}", overlay, overlay_xy, f"vcta_{k}")
+            video_labels[k].append(f"[vcta_{k}]")
+        add_audio(cta.get("audio"), duration, "acta")
+
+    count = len(audio_labels)
+    for k, labels in enumerate(video_labels):
+        filters.append(f"{''.join(labels)}concat=n={count}:v=1:a=0[outv{k}]")
+    outputs = [f"[outa{k}]" for k in range(len(frames))]
+    filters.append(f"{''.join(audio_labels)}concat=n={count}:v=0:a=1,asplit={len(frames)}{''.join(outputs)}")
+    return inputs, ";".join(filters), [f"[outv{k}]" for k in range(len(frames))], outputs
+
+
+def encode_args(profile=None, threads=FFMPEG_THREADS):
+    """x264/AAC output arguments shared by every ffmpeg render"""
+    profile = profile or DEFAULT_PROFILE
+    args = [
+        "-r", str(profile["fps"]),
+        "-c:v", "libx264", "-preset", profile["preset"], "-pix_fmt", "yuv420p",
+        "-threads", str(threads),
+    ]
+    if profile.get("bitrate"):
+        args += ["-b:v", profile["bitrate"]]
+    else:
+        args += ["-crf", str(profile["crf"])]
+    return args + [
+        "-c:a", "aac", "-ar", str(AUDIO_RATE), "-ac", "2",
+        # A fixed timescale keeps independently encoded segments stream-copy compatible
+        "-video_track_timescale", "90000",
+        "-movflags", "+faststart",
+    ]
+
+
+def render_reel(segments, cta, output, profile=None, threads=FFMPEG_THREADS):
+    """Render the whole reel in a single ffmpeg invocation"""
+    profile = profile or DEFAULT_PROFILE
+    return render_reel_multi(segments, cta, [(profile["width"], profile["height"], output)], profile, threads)[0]
+
+
+def render_reel_multi(segments, cta, outputs, profile=None, threads=FFMPEG_THREADS):
+    """Render the reel once per (width, height, path) in `outputs` from a single decode"""
+    profile = profile or DEFAULT_PROFILE
+    frames = [(width, height) for width, height, _ in outputs]
+    inputs, graph, videos, audios = build_multi_filter_graph(segments, cta, frames, profile["fps"])
+    args = [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error"] + inputs + ["-filter_complex", graph]
+    for video, audio, (_, _, path) in zip(videos, audios, outputs):
+        args += ["-map", video, "-map", audio] + encode_args(profile, threads) + [path]
+    _run(args)
+    return [path for _, _, path in outputs]
+
+
+def concat_segments(paths, output, list_path):
+    """Join segments encoded with identical settings using stream copy"""
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    _run(
+        [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error",
+         "-f", "concat", "-safe", "0", "-i", list_path,
+         "-c", "copy", "-movflags", "+faststart", output]
+    )
+    return output
+
+
+def remux_to_ts(path, output, offset):
+    """Rewrap an encoded MP4 segment as MPEG-TS whose timestamps start at `offset` seconds"""
+    _run(
+        [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", "-i", path,
+         "-c", "copy", "-bsf:v", "h264_mp4toannexb",
+         "-output_ts_offset", f"{offset:.3f}", "-f", "mpegts", output]
+    )
+    return output
+
+
+class HlsPlaylist:
+    """Progressive HLS output: an EVENT playlist that grows one segment at a time.
+
+    Players can start on the first segment while later ones are still being
+    encoded; finish() marks the playlist complete.
+    """
+
+    def __init__(self, directory, max_duration):
+        self.directory = directory
+        self.target_duration = math.ceil(max_duration)
+        self.entries = []
+        self.offset = 0.0
+        self.failed = False
+        os.makedirs(directory, exist_ok=True)
+        self._write()
+
+    def _write(self, ended=False):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for name, duration in self.entries:
+            lines += [f"#EXTINF:{duration:.3f},", name]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        path = os.path.join(self.directory, "index.m3u8")
+        # Replace atomically so a player never reads a half-written playlist
+        with open(f"{path}.part", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(f"{path}.part", path)
+
+    def append(self, path):
+        """Remux an encoded segment into the playlist.
+
+        Errors are logged rather than raised, so a failed remux never aborts
+        the render; the playlist is closed with what was published so far.
+        """
+        if self.failed:
+            return
+        try:
+            duration = probe_duration(path)
+            name = f"seg_{len(self.entries)}.ts"
+            tmp_path = os.path.join(self.directory, f"{name}.part")
+            remux_to_ts(path, tmp_path, self.offset)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+            self.offset += duration
+            self.entries.append((name, duration))
+            self._write()
+        except Exception as e:
+            print(f"HLS publishing stopped: {e}")
+            self.failed = True
+            try:
+                self._write(ended=True)
+            except OSError:
+                pass
+
+    def finish(self):
+        if not self.failed:
+            self._write(ended=True)
+
+
+def segment_key(segment, profile, kind="clip"):
+    """Hash of everything that determines an encoded segment's bytes.
+
+    Uses the caption text rather than the per-job overlay PNG path; source and
+    audio paths come from content-addressed caches, so they are stable.
+    """
+    fields = {
+        "kind": kind,
+        "source": segment.get("source"),
+        "start": round(segment.get("start", 0), 3),
+        "duration": round(segment["duration"], 3),
+        "caption": segment.get("caption"),
+        "overlay_xy": list(segment["overlay_xy"]),
+        "audio": segment.get("audio"),
+        "profile": profile,
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _render_cached(segs, card, path, profile, threads):
+    if os.path.exists(path):
+        # Refresh the mtime so LRU eviction keeps segments that are still in use
+        os.utime(path)
+        return path, True
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part.mp4"
+    try:
+        render_reel(segs, card, tmp_path, profile, threads)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path, False
+
+
+def evict_segments(cache_dir, max_bytes=SEGMENT_CACHE_MAX_BYTES):
+    """Delete least recently used cached segments until the cache fits in `max_bytes`"""
+    evict_lru(cache_dir, ".mp4", max_bytes, SEGMENT_CACHE_MIN_AGE)
+
+
+def render_segments(segments, cta, workdir, profile=None, max_workers=VIDEO_RENDER_WORKERS, cache_dir=None,
+                    on_segment=None):
+    """Encode every segment (and the CTA card) as its own MP4, in parallel.
+
+    Each segment runs in its own ffmpeg process; the x264 thread count is
+    split between them so the pool does not oversubscribe the CPU.
+    With `cache_dir`, segments are stored under their segment_key() and a
+    segment that is already cached is reused instead of re-encoded.
+    `on_segment(path)` is called in playback order as soon as a segment and
+    every segment before it are encoded.
+    Returns (paths in playback order, number of segments reused).
+    """
+    profile = profile or DEFAULT_PROFILE
+    jobs = []
+    for i, segment in enumerate(segments):
+        name = f"{segment_key(segment, profile)}.mp4" if cache_dir else f"segment_{i}.mp4"
+        jobs.append(([segment], None, os.path.join(cache_dir or workdir, name)))
+    if cta is not None:
+        name = f"{segment_key(cta, profile, 'cta')}.mp4" if cache_dir else "segment_cta.mp4"
+        jobs.append(([], cta, os.path.join(cache_dir or workdir, name)))
+
+    workers = max(1, min(max_workers, len(jobs)))
+    threads = max(1, (os.cpu_count() or workers) // workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_render_cached if cache_dir else render_reel, segs, card, path, profile, threads)
+            for segs, card, path in jobs
+        ]
+        results = []
+        for future in futures:
+            results.append(future.result())
+            if on_segment is not None:
+                result = results[-1]
+                on_segment(result[0] if cache_dir else result)
+
+    if not cache_dir:
+        return results, 0
+    evict_segments(cache_dir)
+    return [path for path, _ in results], sum(1 for _, reused in results if reused)
+
+
+def render_reel_parallel(segments, cta, output, workdir, profile=None, max_workers=VIDEO_RENDER_WORKERS,
+                         cache_dir=None, on_segment=None):
+    """Render segments concurrently, then stream-copy concat them into `output`.
+    Returns the number of segments reused from `cache_dir`.
+    """
+    paths, reused = render_segments(segments, cta, workdir, profile, max_workers, cache_dir, on_segment)
+    concat_segments(paths, output, os.path.join(workdir, "segments.txt"))
+    return reused
+
+
+def render_formats_parallel(segments, cta, outputs, workdir, profile=None, max_workers=VIDEO_RENDER_WORKERS,
+                            on_segment=None):
+    """Render several frame sizes of one reel, segment by segment in parallel.
+
+    Each segment is decoded once and encoded to every (width, height, path)
+    in `outputs`; the per-size segments are then stream-copy concatenated.
+    `on_segment(path)` receives the first size's segments in playback order.
+    Multi-size renders bypass the segment cache.
+    """
+    profile = profile or DEFAULT_PROFILE
+    jobs = []
+    for i, segment in enumerate(segments):
+        paths = [os.path.join(workdir, f"segment_{i}_{k}.mp4") for k in range(len(outputs))]
+        jobs.append(([segment], None, paths))
+    if cta is not None:
+        paths = [os.path.join(workdir, f"segment_cta_{k}.mp4") for k in range(len(outputs))]
+        jobs.append(([], cta, paths))
+
+    workers = max(1, min(max_workers, len(jobs)))
+    threads = max(1, (os.cpu_count() or workers) // workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                render_reel_multi, segs, card,
+                [(width, height, path) for (width, height, _), path in zip(outputs, paths)],
+                profile, threads
+            )
+            for segs, card, paths in jobs
+        ]
+        results = []
+        for future in futures:
+            results.append(future.result())
+            if on_segment is not None:
+                on_segment(results[-1][0])
+
+    for k, (_, _, output) in enumerate(outputs):
+        concat_segments([paths[k] for paths in results], output, os.path.join(workdir, f"segments_{k}.txt"))
+    return [output for _, _, output in outputs]
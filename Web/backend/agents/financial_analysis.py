@@ -1,119 +1,255 @@
+import asyncio
+from functools import partial
+from agents.response_cache import make_key
+from agents.llm_gateway import complete, acomplete, astream
+from agents.cashflow_analytics import cashflow_metrics, cashflow_facts
+from agents.prompt_compaction import compact_data
+from agents.scenario_analysis import evaluate_scenarios
+from agents.monte_carlo import simulate, simulation_facts, MONTE_CARLO_DRAWS
 
-import os
-from groq import Groq
-from dotenv import load_dotenv
+FINANCIAL_INSIGHT_PROMPT = (
+    "You are a financial analyst. Your task is to provide insights based on the financial data provided. "
+    "Always include the profitable months insight if relevant to the question. "
+    "Use the pre-computed cashflow metrics as given rather than recalculating them."
+)
+WHAT_IF_BATCH_PROMPT = (
+    "You are a financial analyst. You are given a baseline and several what-if scenarios whose "
+    "profit, margin and break-even figures have already been computed and ranked. Do not recalculate them. "
+    "Format your response as follows:\n"
+    "1. Start with one sentence naming the best scenario and why\n"
+    "2. Use bullet points (starting with '-') comparing the top scenarios and flagging any loss-making ones\n"
+    "3. End with a short recommendation\n"
+    "Do NOT use asterisks (**) for formatting. Use clean bullet points with dashes (-)."
+)
+SENSITIVITY_PROMPT = (
+    "You are a financial analyst. You are given the results of a Monte Carlo simulation of monthly profit. "
+    "Explain the risk in plain language without recalculating the numbers. "
+    "Start with one sentence on how likely the business is to stay profitable, then use bullet points "
+    "(starting with '-') for the range of outcomes and the drivers that matter most, and end with one "
+    "practical recommendation. "
+    "Do NOT use asterisks (**) for formatting. Use clean bullet points with dashes (-)."
+)
 
-load_dotenv(dotenv_path='.env')
 
-api_key = os.environ.get("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY not found in .env file")
-
-client = Groq(api_key=api_key)
-
-
-def find_profitable_months_local(data):
-    max_net = -float('inf')
-    profitable_months = []
-    for month_data in data.get('cashflowData', []):
-        month = month_data['month']
-        net = month_data['net']
-        if net > max_net:
-            max_net = net
-            profitable_months = [month]
-        elif net == max_net:
-            profitable_months.append(month)
-    
-    if not profitable_months:
+def _profitable_months_insight(metrics):
+    """Most profitable month(s) by net, taken from cashflow_metrics()"""
+    if not metrics or not metrics["best_months"]:
         return "No profitable months found in the data."
-    elif len(profitable_months) == 1:
+    max_net = metrics["best_months"][0]["net"]
+    profitable_months = [entry["month"] for entry in metrics["best_months"] if entry["net"] == max_net]
+    if len(profitable_months) == 1:
         return f"The most profitable month is {profitable_months[0]} with a net profit of ₹{max_net}."
-    else:
-        return f"The most profitable months are {', '.join(profitable_months)} (tied) with a net profit of ₹{max_net}."
+    return f"The most profitable months are {', '.join(profitable_months)} (tied) with a net profit of ₹{max_net}."
+
+
+def _financial_insight_messages(data: dict, question: str) -> list:
+    """
+    Builds the insight prompt. Passed to the gateway as a builder, so it only
+    runs when the answer is not cached or already being generated.
+    """
+    # Pre-calculate profitable months and the cashflow metrics, so the model
+    # quotes numbers instead of working them out from the raw data
+    metrics = cashflow_metrics(data)
+    profitable_months_insight = _profitable_months_insight(metrics)
+    metrics_facts = cashflow_facts(metrics)
+    data_text, _ = compact_data(data, question, label="generate-insight")
+    return [
+        {
+            "role": "system",
+            "content": FINANCIAL_INSIGHT_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"Here is the financial data:\n{data_text}\n"
+                       f"Pre-calculated profitable months insight: {profitable_months_insight}. "
+                       f"Pre-computed cashflow metrics:\n{metrics_facts}\n"
+                       f"The user's question is: {question}"
+        }
+    ]
 
 
 def get_financial_insight(data: dict, question: str) -> str:
     """
     Generates financial insight using Groq API based on the provided data and question.
     """
-    # Pre-calculate profitable months
-    profitable_months_insight = find_profitable_months_local(data)
+    messages = partial(_financial_insight_messages, data, question)
+    cache_key = make_key("generate-insight", "llama-3.1-8b-instant", FINANCIAL_INSIGHT_PROMPT, data, question)
+    try:
+        return complete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="generate-insight")
+    except Exception as e:
+        return f"An error occurred: {e}"
+
 
+async def get_financial_insight_async(data: dict, question: str) -> str:
+    """
+    Async variant of get_financial_insight for use from async endpoints.
+    """
+    messages = partial(_financial_insight_messages, data, question)
+    cache_key = make_key("generate-insight", "llama-3.1-8b-instant", FINANCIAL_INSIGHT_PROMPT, data, question)
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a financial analyst. Your task is to provide insights based on the financial data provided. Always include the profitable months insight if relevant to the question."
-                },
-                {
-                    "role": "user",
-                    "content": f"Here is the financial data: {data}. "
-                               f"Pre-calculated profitable months insight: {profitable_months_insight}. "
-                               f"The user's question is: {question}"
-                }
-            ],
-            model="llama-3.1-8b-instant",
-        )
-        return chat_completion.choices[0].message.content
+        return await acomplete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="generate-insight")
     except Exception as e:
         return f"An error occurred: {e}"
 
 
+async def stream_financial_insight(data: dict, question: str):
+    """
+    Streams financial insight tokens as they are generated.
+    """
+    messages = partial(_financial_insight_messages, data, question)
+    cache_key = make_key("generate-insight", "llama-3.1-8b-instant", FINANCIAL_INSIGHT_PROMPT, data, question)
+    try:
+        async for token in astream(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="generate-insight"):
+            yield token
+    except Exception as e:
+        yield f"An error occurred: {e}"
+
+
+def _is_simple_revenue_expense_update(modified_data) -> bool:
+    # Check if modified_data is a simple revenue/expense update
+    is_simple_revenue_expense_update = False
+    if isinstance(modified_data, dict) and all(key in modified_data for key in ["Monthly revenue", "Monthly expenses"]):
+        # Further check if there are only these keys (and potentially 'Monthly profit')
+        if len(modified_data) <= 3 and all(key in ["Monthly revenue", "Monthly expenses", "Monthly profit"] for key in modified_data.keys()):
+            is_simple_revenue_expense_update = True
+    return is_simple_revenue_expense_update
+
+
+def _what_if_system_prompt(modified_data) -> str:
+    """
+    Adjusts the prompt based on the complexity of the modified_data.
+    """
+    if _is_simple_revenue_expense_update(modified_data):
+        return (
+            "You are a financial analyst. Your task is to provide a concise financial analysis "
+            "comparing the original and modified monthly revenue and expenses. "
+            "Format your response as follows:\n"
+            "1. Start with a brief introductory sentence about the scenario\n"
+            "2. Use bullet points (starting with '-') for key findings\n"
+            "3. Keep the analysis clear and well-spaced\n"
+            "4. Highlight the financial impact (increase/decrease in profit)\n"
+            "5. Provide practical insights about what this means for the business\n"
+            "Do NOT use asterisks (**) for formatting. Use clean bullet points with dashes (-)."
+        )
+    return (
+        "You are a financial analyst. Your task is to analyze a what-if scenario and provide a comprehensive breakdown of the financial impact. "
+        "Format your response as follows:\n"
+        "1. Start with a brief summary of the comparison\n"
+        "2. Create a section titled 'Pros of the Modified Scenario:' with bullet points (starting with '-')\n"
+        "3. Create a section titled 'Cons of the Modified Scenario:' with bullet points (starting with '-')\n"
+        "4. Create a section titled 'Mitigation Strategies:' with bullet points (starting with '-')\n"
+        "5. Use clear line breaks between sections for better readability\n"
+        "Do NOT use asterisks (**) for formatting. Use clean bullet points with dashes (-)."
+    )
+
+
+def _what_if_messages(original_data: dict, modified_data: dict) -> list:
+    original_text, _ = compact_data(original_data, label="what-if-analysis")
+    modified_text, _ = compact_data(modified_data, label="what-if-analysis")
+    if _is_simple_revenue_expense_update(modified_data):
+        user_content = (
+            f"Here is the original financial data:\n{original_text}\n"
+            f"Here is the modified scenario with new monthly revenue and expenses:\n{modified_text}\n"
+            f"Please provide a concise analysis of the financial impact with proper formatting."
+        )
+    else:
+        user_content = (
+            f"Here is the original financial data:\n{original_text}\n"
+            f"Here is the modified scenario:\n{modified_text}\n"
+            f"Please analyze the financial impact of these changes following the requested structure."
+        )
+
+    return [
+        {"role": "system", "content": _what_if_system_prompt(modified_data)},
+        {"role": "user", "content": user_content}
+    ]
+
+
 def analyze_what_if_scenario(original_data: dict, modified_data: dict) -> str:
     """
     Analyzes a what-if scenario by comparing original and modified financial data.
-    Adjusts the prompt based on the complexity of the modified_data.
     """
+    messages = partial(_what_if_messages, original_data, modified_data)
+    cache_key = make_key("what-if-analysis", "llama-3.1-8b-instant", _what_if_system_prompt(modified_data), {"original_data": original_data, "modified_data": modified_data})
     try:
-        # Check if modified_data is a simple revenue/expense update
-        is_simple_revenue_expense_update = False
-        if isinstance(modified_data, dict) and all(key in modified_data for key in ["Monthly revenue", "Monthly expenses"]):
-            # Further check if there are only these keys (and potentially 'Monthly profit')
-            if len(modified_data) <= 3 and all(key in ["Monthly revenue", "Monthly expenses", "Monthly profit"] for key in modified_data.keys()):
-                is_simple_revenue_expense_update = True
-
-        if is_simple_revenue_expense_update:
-            system_content = (
-                "You are a financial analyst. Your task is to provide a concise financial analysis "
-                "comparing the original and modified monthly revenue and expenses. "
-                "Format your response as follows:\n"
-                "1. Start with a brief introductory sentence about the scenario\n"
-                "2. Use bullet points (starting with '-') for key findings\n"
-                "3. Keep the analysis clear and well-spaced\n"
-                "4. Highlight the financial impact (increase/decrease in profit)\n"
-                "5. Provide practical insights about what this means for the business\n"
-                "Do NOT use asterisks (**) for formatting. Use clean bullet points with dashes (-)."
-            )
-            user_content = (
-                f"Here is the original financial data: {original_data}. "
-                f"Here is the modified scenario with new monthly revenue and expenses: {modified_data}. "
-                f"Please provide a concise analysis of the financial impact with proper formatting."
-            )
-        else:
-            system_content = (
-                "You are a financial analyst. Your task is to analyze a what-if scenario and provide a comprehensive breakdown of the financial impact. "
-                "Format your response as follows:\n"
-                "1. Start with a brief summary of the comparison\n"
-                "2. Create a section titled 'Pros of the Modified Scenario:' with bullet points (starting with '-')\n"
-                "3. Create a section titled 'Cons of the Modified Scenario:' with bullet points (starting with '-')\n"
-                "4. Create a section titled 'Mitigation Strategies:' with bullet points (starting with '-')\n"
-                "5. Use clear line breaks between sections for better readability\n"
-                "Do NOT use asterisks (**) for formatting. Use clean bullet points with dashes (-)."
-            )
-            user_content = (
-                f"Here is the original financial data: {original_data}. "
-                f"Here is the modified scenario: {modified_data}. "
-                f"Please analyze the financial impact of these changes following the requested structure."
-            )
-
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": user_content}
-            ],
-            model="llama-3.1-8b-instant",
-        )
-        return chat_completion.choices[0].message.content
+        return complete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="what-if-analysis")
     except Exception as e:
         return f"An error occurred: {e}"
+
+
+async def analyze_what_if_scenario_async(original_data: dict, modified_data: dict) -> str:
+    """
+    Async variant of analyze_what_if_scenario for use from async endpoints.
+    """
+    messages = partial(_what_if_messages, original_data, modified_data)
+    cache_key = make_key("what-if-analysis", "llama-3.1-8b-instant", _what_if_system_prompt(modified_data), {"original_data": original_data, "modified_data": modified_data})
+    try:
+        return await acomplete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="what-if-analysis")
+    except Exception as e:
+        return f"An error occurred: {e}"
+
+
+def _what_if_batch_messages(evaluation: dict) -> list:
+    data_text, _ = compact_data(
+        {"baseline": evaluation["baseline"], "scenarios": evaluation["scenarios"]}, label="what-if-batch"
+    )
+    return [
+        {
+            "role": "system",
+            "content": WHAT_IF_BATCH_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"Here are the computed scenario results (monthly figures, ranked by {evaluation['rank_by']}):\n{data_text}"
+        }
+    ]
+
+
+async def analyze_what_if_batch_async(original_data: dict, scenarios: list, numbers_only: bool = False,
+                                      rank_by: str = "profit") -> dict:
+    """
+    Evaluates many what-if scenarios locally and, unless `numbers_only`, adds a
+    single narrative comparing them.
+    """
+    evaluation = evaluate_scenarios(original_data, scenarios, rank_by)
+    if numbers_only:
+        return {**evaluation, "analysis": None}
+    messages = partial(_what_if_batch_messages, evaluation)
+    cache_key = make_key("what-if-batch", "llama-3.1-8b-instant", WHAT_IF_BATCH_PROMPT, evaluation)
+    try:
+        analysis = await acomplete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="what-if-batch")
+    except Exception as e:
+        analysis = f"An error occurred: {e}"
+    return {**evaluation, "analysis": analysis}
+
+
+def _sensitivity_messages(simulation: dict) -> list:
+    return [
+        {
+            "role": "system",
+            "content": SENSITIVITY_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"Simulation results:\n{simulation_facts(simulation)}"
+        }
+    ]
+
+
+async def analyze_sensitivity_async(original_data: dict, drivers: dict, draws: int = MONTE_CARLO_DRAWS, seed: int = None,
+                                    narrative: bool = False) -> dict:
+    """
+    Runs a Monte Carlo sensitivity simulation locally and, with `narrative`,
+    adds a short LLM summary of the results.
+    """
+    # Up to MONTE_CARLO_MAX_DRAWS draws is enough NumPy work to stall the event loop
+    simulation = await asyncio.to_thread(simulate, original_data, drivers, draws, seed)
+    if not narrative:
+        return {**simulation, "analysis": None}
+    messages = partial(_sensitivity_messages, simulation)
+    cache_key = make_key("what-if-sensitivity", "llama-3.1-8b-instant", SENSITIVITY_PROMPT, simulation)
+    try:
+        analysis = await acomplete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="what-if-sensitivity")
+    except Exception as e:
+        analysis = f"An error occurred: {e}"
+    return {**simulation, "analysis": analysis}
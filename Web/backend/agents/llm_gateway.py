@@ -0,0 +1,232 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import Future
+import httpx
+from groq import Groq, AsyncGroq
+from dotenv import load_dotenv
+from agents.response_cache import response_cache
+
+load_dotenv(dotenv_path='.env')
+
+api_key = os.environ.get("GROQ_API_KEY")
+if not api_key:
+    raise ValueError("GROQ_API_KEY not found in .env file")
+
+# Upper bound on LLM calls in flight from a single worker, sync and async
+# together. Requests beyond this wait on a semaphore instead of piling more
+# sockets onto Groq.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "100"))
+# Share of the cap reserved for sync callers (job threads, sync endpoints); the rest is async
+LLM_SYNC_CONCURRENCY = min(
+    int(os.getenv("LLM_SYNC_CONCURRENCY", str(max(1, LLM_MAX_CONCURRENCY // 4)))),
+    max(1, LLM_MAX_CONCURRENCY - 1),
+)
+_async_concurrency = max(1, LLM_MAX_CONCURRENCY - LLM_SYNC_CONCURRENCY)
+
+# Connection pool tuning shared by every agent. Each client's pool is sized to
+# its share of the cap, so calls wait on the semaphore rather than inside httpx.
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+# Wait for a free pooled connection; only reached if something bypasses the semaphore
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+
+def _limits(max_connections):
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=min(LLM_KEEPALIVE_CONNECTIONS, max_connections),
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+_timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT, pool=LLM_POOL_TIMEOUT)
+
+client = Groq(
+    api_key=api_key,
+    http_client=httpx.Client(limits=_limits(LLM_SYNC_CONCURRENCY), timeout=_timeout),
+    max_retries=LLM_MAX_RETRIES,
+)
+async_client = AsyncGroq(
+    api_key=api_key,
+    http_client=httpx.AsyncClient(limits=_limits(_async_concurrency), timeout=_timeout),
+    max_retries=LLM_MAX_RETRIES,
+)
+
+_semaphore = asyncio.Semaphore(_async_concurrency)
+_sync_semaphore = threading.BoundedSemaphore(LLM_SYNC_CONCURRENCY)
+
+# Single-flight: identical requests (same cache key and model) already on
+# their way to Groq. Later callers wait for that call instead of making their own.
+_inflight = {}
+_sync_inflight = {}
+_flight_lock = threading.Lock()
+_flight_stats = {"upstream_calls": 0, "collapsed": 0}
+
+
+def _count_flight(outcome):
+    with _flight_lock:
+        _flight_stats[outcome] += 1
+
+
+def single_flight_stats() -> dict:
+    """
+    Upstream calls made for keyed requests, and requests that were served
+    by joining an identical call already in flight.
+    """
+    with _flight_lock:
+        stats = dict(_flight_stats)
+        stats["in_flight"] = len(_inflight) + len(_sync_inflight)
+    total = stats["upstream_calls"] + stats["collapsed"]
+    stats["collapse_rate"] = stats["collapsed"] / total if total else 0.0
+    return stats
+
+
+def complete(messages: list, model: str, cache_key: str = None, endpoint: str = None, **kwargs) -> str:
+    """
+    Runs a chat completion on the shared pooled client.
+    When `cache_key` is given the response cache is consulted first, and
+    concurrent calls with the same key share one upstream request.
+    `messages` may be a callable returning the list; it is only called when
+    the request actually goes upstream.
+    """
+    if not cache_key:
+        return _create(messages, model, cache_key, endpoint, kwargs)
+
+    cached = response_cache.get(cache_key, endpoint)
+    if cached is not None:
+        return cached
+
+    flight = (cache_key, model)
+    with _flight_lock:
+        future = _sync_inflight.get(flight)
+        leader = future is None
+        if leader:
+            future = _sync_inflight[flight] = Future()
+    if not leader:
+        _count_flight("collapsed")
+        return future.result()
+
+    _count_flight("upstream_calls")
+    try:
+        content = _create(messages, model, cache_key, endpoint, kwargs)
+        future.set_result(content)
+        return content
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _flight_lock:
+            _sync_inflight.pop(flight, None)
+
+
+def _build(messages):
+    """Messages may be passed as a builder so cache hits skip preparing the prompt"""
+    return messages() if callable(messages) else messages
+
+
+def _create(messages, model, cache_key, endpoint, kwargs):
+    messages = _build(messages)
+    with _sync_semaphore:
+        chat_completion = client.chat.completions.create(
+            messages=messages,
+            model=model,
+            **kwargs
+        )
+    content = chat_completion.choices[0].message.content
+
+    if cache_key and content:
+        response_cache.put(cache_key, content, endpoint)
+    return content
+
+
+async def acomplete(messages: list, model: str, cache_key: str = None, endpoint: str = None, **kwargs) -> str:
+    """
+    Runs a chat completion on the async client without blocking the event loop.
+    When `cache_key` is given the response cache is consulted first, and
+    concurrent calls with the same key await one upstream request.
+    `messages` may be a callable, as for complete().
+    """
+    if not cache_key:
+        return await _acreate(messages, model, cache_key, endpoint, kwargs)
+
+    cached = await response_cache.aget(cache_key, endpoint)
+    if cached is not None:
+        return cached
+
+    flight = (cache_key, model)
+    task = _inflight.get(flight)
+    if task is None:
+        _count_flight("upstream_calls")
+        # A task of its own, so one caller disconnecting does not cancel the call for the others
+        task = _inflight[flight] = asyncio.ensure_future(_acreate(messages, model, cache_key, endpoint, kwargs))
+        task.add_done_callback(lambda done: _inflight.pop(flight, None) if _inflight.get(flight) is done else None)
+    else:
+        _count_flight("collapsed")
+    return await asyncio.shield(task)
+
+
+async def _acreate(messages, model, cache_key, endpoint, kwargs):
+    messages = _build(messages)
+    async with _semaphore:
+        chat_completion = await async_client.chat.completions.create(
+            messages=messages,
+            model=model,
+            **kwargs
+        )
+    content = chat_completion.choices[0].message.content
+
+    if cache_key and content:
+        await response_cache.aput(cache_key, content, endpoint)
+    return content
+
+
+async def astream(messages: list, model: str, cache_key: str = None, endpoint: str = None, **kwargs):
+    """
+    Yields completion tokens as they arrive. The full text is written to the
+    response cache once the stream completes, so later non-streaming calls hit it.
+    `messages` may be a callable, as for complete().
+    """
+    if cache_key:
+        cached = await response_cache.aget(cache_key, endpoint)
+        if cached is not None:
+            yield cached
+            return
+        # Join an identical non-streaming call that is already running
+        task = _inflight.get((cache_key, model))
+        if task is not None:
+            _count_flight("collapsed")
+            yield await asyncio.shield(task)
+            return
+
+    messages = _build(messages)
+    parts = []
+    async with _semaphore:
+        stream = await async_client.chat.completions.create(
+            messages=messages,
+            model=model,
+            stream=True,
+            **kwargs
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                parts.append(token)
+                yield token
+
+    content = "".join(parts)
+    if cache_key and content:
+        await response_cache.aput(cache_key, content, endpoint)
+
+
+async def aclose():
+    """
+    Closes the pooled HTTP clients. Called on application shutdown.
+    """
+    await async_client.close()
+    client.close()
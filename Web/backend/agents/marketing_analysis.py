@@ -1,56 +1,90 @@
-import os
-from groq import Groq
-from dotenv import load_dotenv
+from functools import partial
+from agents.response_cache import make_key
+from agents.prompt_compaction import compact_data
+from agents.llm_gateway import complete, acomplete, astream
 
-load_dotenv(dotenv_path='.env')
+MARKETING_INSIGHT_PROMPT = "You are a marketing strategist and data analyst. Your task is to provide actionable marketing insights and recommendations based on campaign performance, customer sentiment, and engagement data provided."
+CAMPAIGN_STRATEGY_PROMPT = "You are a marketing strategist. Analyze the provided campaign data and suggest optimization strategies. Be concise but actionable."
 
-api_key = os.environ.get("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY not found in .env file")
+def _marketing_insight_messages(data: dict, question: str) -> list:
+    data_text, _ = compact_data(data, question, label="generate-marketing-insight")
+    return [
+        {
+            "role": "system",
+            "content": MARKETING_INSIGHT_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"Here is the marketing data:\n{data_text}\nThe user's question is: {question}"
+        }
+    ]
 
-client = Groq(api_key=api_key)
+def _campaign_strategy_messages(campaign_data: dict) -> list:
+    campaign_text, _ = compact_data(campaign_data, label="analyze-campaign-strategy")
+    return [
+        {
+            "role": "system",
+            "content": CAMPAIGN_STRATEGY_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"Analyze this campaign data and suggest improvements:\n{campaign_text}"
+        }
+    ]
 
 def get_marketing_insight(data: dict, question: str) -> str:
     """
     Generates marketing insight using Groq API based on the provided data and question.
     """
+    messages = partial(_marketing_insight_messages, data, question)
+    cache_key = make_key("generate-marketing-insight", "llama-3.1-8b-instant", MARKETING_INSIGHT_PROMPT, data, question)
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a marketing strategist and data analyst. Your task is to provide actionable marketing insights and recommendations based on campaign performance, customer sentiment, and engagement data provided."
-                },
-                {
-                    "role": "user",
-                    "content": f"Here is the marketing data: {data}. The user's question is: {question}"
-                }
-            ],
-            model="llama-3.1-8b-instant",
-        )
-        return chat_completion.choices[0].message.content
+        return complete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="generate-marketing-insight")
     except Exception as e:
         return f"An error occurred: {e}"
 
+async def get_marketing_insight_async(data: dict, question: str) -> str:
+    """
+    Async variant of get_marketing_insight for use from async endpoints.
+    """
+    messages = partial(_marketing_insight_messages, data, question)
+    cache_key = make_key("generate-marketing-insight", "llama-3.1-8b-instant", MARKETING_INSIGHT_PROMPT, data, question)
+    try:
+        return await acomplete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="generate-marketing-insight")
+    except Exception as e:
+        return f"An error occurred: {e}"
+
+async def stream_marketing_insight(data: dict, question: str):
+    """
+    Streams marketing insight tokens as they are generated.
+    """
+    messages = partial(_marketing_insight_messages, data, question)
+    cache_key = make_key("generate-marketing-insight", "llama-3.1-8b-instant", MARKETING_INSIGHT_PROMPT, data, question)
+    try:
+        async for token in astream(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="generate-marketing-insight"):
+            yield token
+    except Exception as e:
+        yield f"An error occurred: {e}"
+
 def analyze_campaign_strategy(campaign_data: dict) -> str:
     """
     Analyzes campaign strategy and provides recommendations.
     """
+    messages = partial(_campaign_strategy_messages, campaign_data)
+    cache_key = make_key("analyze-campaign-strategy", "llama-3.1-8b-instant", CAMPAIGN_STRATEGY_PROMPT, campaign_data)
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a marketing strategist. Analyze the provided campaign data and suggest optimization strategies. Be concise but actionable."
-                },
-                {
-                    "role": "user",
-                    "content": f"Analyze this campaign data and suggest improvements: {campaign_data}"
-                }
-            ],
-            model="llama-3.1-8b-instant",
-        )
-        return chat_completion.choices[0].message.content
+        return complete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="analyze-campaign-strategy")
+    except Exception as e:
+        return f"An error occurred: {e}"
+
+async def analyze_campaign_strategy_async(campaign_data: dict) -> str:
+    """
+    Async variant of analyze_campaign_strategy for use from async endpoints.
+    """
+    messages = partial(_campaign_strategy_messages, campaign_data)
+    cache_key = make_key("analyze-campaign-strategy", "llama-3.1-8b-instant", CAMPAIGN_STRATEGY_PROMPT, campaign_data)
+    try:
+        return await acomplete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="analyze-campaign-strategy")
     except Exception as e:
         return f"An error occurred: {e}"
 
@@ -78,9 +112,9 @@ def generate_campaign_suggestions(market_data: dict) -> str:
 Format EXACTLY as 3 numbered items (1. 2. 3.) with title and description. Write in English. Each item must have a title and brief description."""
 
     try:
-        # Make the API call - this is synchronous
-        chat_completion = client.chat.completions.create(
-            messages=[
+        # Through the gateway, so the call shares its concurrency limit
+        response_content = complete(
+            [
                 {
                     "role": "system",
                     "content": "You are a creative marketing specialist. Generate exactly 3 specific campaign ideas. Format as 3 numbered items. Respond in English."
@@ -93,12 +127,6 @@ Format EXACTLY as 3 numbered items (1. 2. 3.) with title and description. Write
             model="llama-3.1-8b-instant",
         )
         
-        # Extract content safely
-        try:
-            response_content = chat_completion.choices[0].message.content
-        except (AttributeError, IndexError, TypeError):
-            response_content = None
-        
         # Validate response
         if response_content is None:
             response_content = "1. Campaign One\n2. Campaign Two\n3. Campaign Three"
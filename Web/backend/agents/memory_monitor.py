@@ -0,0 +1,65 @@
+import os
+import threading
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# Seconds between RSS samples while a job runs
+RSS_SAMPLE_INTERVAL = float(os.getenv("RSS_SAMPLE_INTERVAL", "0.2"))
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class RssMonitor:
+    """
+    Samples the process RSS on a background thread for the duration of a
+    with-block and records the start, peak and end values.
+
+    RSS is process-wide, so when jobs overlap each one's peak includes the
+    others; a flat `rss_end_mb` across jobs is the signal that nothing leaks.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start = self.peak = self.end = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _record(self, rss):
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record(current_rss())
+
+    def __enter__(self):
+        self.start = current_rss()
+        self._record(self.start)
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, name="rss-monitor", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.end = current_rss()
+        self._record(self.end)
+        return False
+
+    def report(self):
+        """Start, peak and end RSS in MiB, or None if RSS cannot be read here"""
+        if self.start is None:
+            return None
+        return {
+            "rss_start_mb": round(self.start / 1024 ** 2, 1),
+            "rss_peak_mb": round(self.peak / 1024 ** 2, 1),
+            "rss_end_mb": round(self.end / 1024 ** 2, 1),
+        }
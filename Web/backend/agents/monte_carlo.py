@@ -0,0 +1,144 @@
+import os
+import numpy as np
+from agents.scenario_analysis import baseline
+from agents.cashflow_analytics import parse_number, _value
+
+MONTE_CARLO_DRAWS = int(os.getenv("MONTE_CARLO_DRAWS", "5000"))
+MONTE_CARLO_MAX_DRAWS = int(os.getenv("MONTE_CARLO_MAX_DRAWS", "200000"))
+PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+DISTRIBUTIONS = ("normal", "uniform", "triangular")
+
+
+def _multipliers(spec: dict, rng, draws: int):
+    """
+    Draws multipliers around 1.0 for one driver. Percentages are relative to
+    the baseline value:
+      {"distribution": "normal", "sd_pct": 10}
+      {"distribution": "uniform", "low_pct": -15, "high_pct": 15}
+      {"distribution": "triangular", "low_pct": -20, "mode_pct": 0, "high_pct": 10}
+    """
+    distribution = spec.get("distribution", "normal")
+    if distribution == "normal":
+        return rng.normal(1 + spec.get("mean_pct", 0) / 100, spec.get("sd_pct", 10) / 100, draws)
+    low = 1 + spec.get("low_pct", -10) / 100
+    high = 1 + spec.get("high_pct", 10) / 100
+    if high < low:
+        raise ValueError("high_pct must not be below low_pct")
+    if distribution == "uniform":
+        return rng.uniform(low, high, draws)
+    if distribution == "triangular":
+        mode = 1 + spec.get("mode_pct", 0) / 100
+        if not low <= mode <= high:
+            raise ValueError("mode_pct must lie between low_pct and high_pct")
+        if low == high:
+            return np.full(draws, low)
+        return rng.triangular(low, mode, high, draws)
+    raise ValueError(f"Unknown distribution '{distribution}'. Choose one of: {', '.join(DISTRIBUTIONS)}")
+
+
+def _components(original_data: dict, drivers: dict):
+    """
+    Monthly baseline amounts per driver. Expenses are split into the
+    expenseBreakdown categories named in `drivers`, the rest staying in
+    "expenses".
+    """
+    base = baseline(original_data)
+    components = {"revenue": base["revenue"], "expenses": base["expenses"]}
+    breakdown = {
+        str(item.get("name")): parse_number(item.get("value")) or 0.0
+        for item in original_data.get("expenseBreakdown") or [] if isinstance(item, dict)
+    }
+    total_share = sum(breakdown.values())
+    for name in drivers:
+        if name in components:
+            continue
+        if name not in breakdown or not total_share:
+            raise ValueError(f"Unknown driver '{name}'. Use revenue, expenses or an expenseBreakdown name")
+        components[name] = base["expenses"] * breakdown[name] / total_share
+        components["expenses"] -= components[name]
+    return components
+
+
+def simulate(original_data: dict, drivers: dict, draws: int = MONTE_CARLO_DRAWS, seed: int = None) -> dict:
+    """
+    Monte Carlo simulation of monthly profit. `drivers` maps "revenue",
+    "expenses" or an expenseBreakdown category to a distribution spec (see
+    _multipliers); drivers not listed stay at their baseline.
+
+    Returns profit and margin percentile bands, the probability of a loss and
+    tornado sensitivities (the profit swing when each driver alone moves
+    between its 10th and 90th percentile).
+    """
+    if not 1 <= draws <= MONTE_CARLO_MAX_DRAWS:
+        raise ValueError(f"draws must be between 1 and {MONTE_CARLO_MAX_DRAWS}")
+    rng = np.random.default_rng(seed)
+    components = _components(original_data, drivers)
+    names = list(components)
+    amounts = np.array([components[name] for name in names])
+    # +1 for revenue, -1 for every expense component
+    signs = np.array([1.0 if name == "revenue" else -1.0 for name in names])
+
+    samples = np.ones((len(names), draws))
+    for row, name in enumerate(names):
+        if name in drivers:
+            samples[row] = _multipliers(drivers[name], rng, draws)
+
+    weighted = (signs * amounts)[:, None] * samples
+    profit = weighted.sum(axis=0)
+    revenue = weighted[names.index("revenue")]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margin = np.where(revenue != 0, profit / revenue * 100, np.nan)
+    base_profit = float((signs * amounts).sum())
+
+    tornado = []
+    for row, name in enumerate(names):
+        if name not in drivers:
+            continue
+        low, high = np.percentile(samples[row], [10, 90])
+        profit_low = base_profit + signs[row] * amounts[row] * (low - 1)
+        profit_high = base_profit + signs[row] * amounts[row] * (high - 1)
+        tornado.append({
+            "driver": name,
+            "profit_at_driver_p10": _value(profit_low),
+            "profit_at_driver_p90": _value(profit_high),
+            "swing": _value(abs(profit_high - profit_low)),
+        })
+    tornado.sort(key=lambda entry: -entry["swing"])
+
+    profit_bands = np.percentile(profit, PERCENTILES)
+    if np.isfinite(margin).any():
+        margin_bands = np.nanpercentile(margin, PERCENTILES)
+    else:
+        margin_bands = [np.nan] * len(PERCENTILES)
+    return {
+        "draws": draws,
+        "baseline": {name: _value(amount) for name, amount in components.items()} | {"profit": _value(base_profit)},
+        "profit": {
+            "mean": _value(profit.mean()),
+            "std": _value(profit.std()),
+            "percentiles": {f"p{p}": _value(v) for p, v in zip(PERCENTILES, profit_bands)},
+        },
+        "margin_pct": {"percentiles": {f"p{p}": _value(v) for p, v in zip(PERCENTILES, margin_bands)}},
+        "probability_of_loss": round(float((profit < 0).mean()), 4),
+        "tornado": tornado,
+    }
+
+
+def simulation_facts(result: dict) -> str:
+    """
+    Renders the headline simulation numbers as short lines for an LLM prompt.
+    """
+    bands = result["profit"]["percentiles"]
+    lines = [
+        f"Simulated draws: {result['draws']}",
+        f"Baseline monthly profit: ₹{result['baseline']['profit']}",
+        f"Monthly profit P5/P50/P95: ₹{bands['p5']} / ₹{bands['p50']} / ₹{bands['p95']}",
+        f"Expected monthly profit: ₹{result['profit']['mean']} (std ₹{result['profit']['std']})",
+        f"Probability of a loss: {round(result['probability_of_loss'] * 100, 1)}%",
+    ]
+    for entry in result["tornado"]:
+        lines.append(
+            f"Sensitivity to {entry['driver']}: profit ₹{entry['profit_at_driver_p10']} "
+            f"to ₹{entry['profit_at_driver_p90']} (swing ₹{entry['swing']})"
+        )
+    return "\n".join(lines)
@@ -1,33 +1,53 @@
-import os
-from groq import Groq
-from dotenv import load_dotenv
+from functools import partial
+from agents.response_cache import make_key
+from agents.prompt_compaction import compact_data
+from agents.llm_gateway import complete, acomplete, astream
 
-load_dotenv(dotenv_path='.env')
+OPERATIONS_INSIGHT_PROMPT = "You are an operations management expert. Your task is to provide actionable insights and recommendations based on the operations data provided."
 
-api_key = os.environ.get("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY not found in .env file")
-
-client = Groq(api_key=api_key)
+def _operations_insight_messages(data: dict, question: str) -> list:
+    data_text, _ = compact_data(data, question, label="generate-operations-insight")
+    return [
+        {
+            "role": "system",
+            "content": OPERATIONS_INSIGHT_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"Here is the operations data:\n{data_text}\nThe user's question is: {question}"
+        }
+    ]
 
 def get_operations_insight(data: dict, question: str) -> str:
     """
     Generates operations insight using Groq API based on the provided data and question.
     """
+    messages = partial(_operations_insight_messages, data, question)
+    cache_key = make_key("generate-operations-insight", "llama-3.1-8b-instant", OPERATIONS_INSIGHT_PROMPT, data, question)
+    try:
+        return complete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="generate-operations-insight")
+    except Exception as e:
+        return f"An error occurred: {e}"
+
+async def get_operations_insight_async(data: dict, question: str) -> str:
+    """
+    Async variant of get_operations_insight for use from async endpoints.
+    """
+    messages = partial(_operations_insight_messages, data, question)
+    cache_key = make_key("generate-operations-insight", "llama-3.1-8b-instant", OPERATIONS_INSIGHT_PROMPT, data, question)
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an operations management expert. Your task is to provide actionable insights and recommendations based on the operations data provided."
-                },
-                {
-                    "role": "user",
-                    "content": f"Here is the operations data: {data}. The user's question is: {question}"
-                }
-            ],
-            model="llama-3.1-8b-instant",
-        )
-        return chat_completion.choices[0].message.content
+        return await acomplete(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="generate-operations-insight")
     except Exception as e:
         return f"An error occurred: {e}"
+
+async def stream_operations_insight(data: dict, question: str):
+    """
+    Streams operations insight tokens as they are generated.
+    """
+    messages = partial(_operations_insight_messages, data, question)
+    cache_key = make_key("generate-operations-insight", "llama-3.1-8b-instant", OPERATIONS_INSIGHT_PROMPT, data, question)
+    try:
+        async for token in astream(messages, model="llama-3.1-8b-instant", cache_key=cache_key, endpoint="generate-operations-insight"):
+            yield token
+    except Exception as e:
+        yield f"An error occurred: {e}"
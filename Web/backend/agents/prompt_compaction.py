@@ -0,0 +1,184 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+
+# Approximate token budget for the data section of a prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2000"))
+# Tables longer than this keep only their most recent rows plus a summary line
+PROMPT_SERIES_MAX_ROWS = int(os.getenv("PROMPT_SERIES_MAX_ROWS", "12"))
+# Presentation-only fields that never help the model
+PROMPT_DROP_FIELDS = set(filter(None, os.getenv("PROMPT_DROP_FIELDS", "id,color,icon,className").split(",")))
+# Per-request reports kept for /api/cache-stats
+PROMPT_REPORT_HISTORY = int(os.getenv("PROMPT_REPORT_HISTORY", "50"))
+
+logger = logging.getLogger(__name__)
+
+_stats = {"requests": 0, "original_tokens": 0, "compact_tokens": 0, "sections_dropped": 0, "series_summarized": 0}
+_stats_lock = threading.Lock()
+_recent = deque(maxlen=PROMPT_REPORT_HISTORY)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (about four characters per token for English and numbers).
+    """
+    return (len(text) + 3) // 4
+
+
+def _words(name):
+    """Lowercase words of a camelCase / snake_case key"""
+    return [w.lower() for w in re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+", str(name)) if len(w) > 2]
+
+
+def _related(question_words, name):
+    """True when a word of `name` shares a stem with a question word ("expenses" ~ expenseBreakdown)"""
+    for word in _words(name):
+        for other in question_words:
+            shorter = min(len(word), len(other))
+            common = len(os.path.commonprefix([word, other]))
+            if common >= min(6, shorter):
+                return True
+    return False
+
+
+def _cell(value):
+    if isinstance(value, float):
+        value = round(value, 2)
+        return str(int(value)) if value.is_integer() else str(value)
+    text = str(value)
+    return f'"{text}"' if "," in text else text
+
+
+def _table(rows):
+    columns = []
+    for row in rows:
+        for key in row:
+            if key not in columns and key not in PROMPT_DROP_FIELDS:
+                columns.append(key)
+    lines = [",".join(columns)]
+    lines += [",".join(_cell(row.get(column, "")) for column in columns) for row in rows]
+    return lines
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _summary_row(rows):
+    """min/mean/max of every numeric column"""
+    parts = []
+    for key in rows[0]:
+        values = [row.get(key) for row in rows]
+        if key in PROMPT_DROP_FIELDS or not all(_is_number(value) for value in values):
+            continue
+        parts.append(f"{key} min {_cell(float(min(values)))} mean {_cell(sum(values) / len(values))} "
+                     f"max {_cell(float(max(values)))}")
+    return "; ".join(parts)
+
+
+def _section(name, value, max_rows):
+    """Render one top-level field; returns (text, summarized)"""
+    if isinstance(value, list) and value and all(isinstance(row, dict) for row in value):
+        rows = value
+        summarized = len(rows) > max_rows
+        header = f"{name} ({len(rows)} rows)"
+        if summarized:
+            header += f", all rows: {_summary_row(rows)}; last {max_rows} rows"
+            rows = rows[-max_rows:]
+        return header + ":\n" + "\n".join(_table(rows)), summarized
+    if isinstance(value, dict):
+        lines = []
+        for key, item in value.items():
+            if key in PROMPT_DROP_FIELDS:
+                continue
+            text, _ = _section(key, item, max_rows)
+            lines.append(text)
+        return f"{name}:\n" + "\n".join("  " + line.replace("\n", "\n  ") for line in lines), False
+    if isinstance(value, list):
+        return f"{name}: {', '.join(_cell(item) for item in value)}", False
+    return f"{name}: {_cell(value)}", False
+
+
+def compact_data(data, question: str = None, budget: int = PROMPT_TOKEN_BUDGET, label: str = None):
+    """
+    Serializes `data` compactly for a prompt: lists of records become CSV
+    tables, long tables are summarized, presentation fields are dropped and,
+    if the result is still over `budget` tokens, the sections least related
+    to `question` are dropped and the remainder is truncated.
+    Returns (text, report) where report compares it with repr(data).
+    Each report is logged and kept among the recent reports in
+    compaction_stats(); `label` names the prompt it was built for.
+    """
+    original = str(data)
+    if not isinstance(data, dict):
+        data = {"data": data}
+    question_words = set(_words(question or ""))
+
+    sections = []
+    summarized = []
+    for name, value in data.items():
+        if name in PROMPT_DROP_FIELDS:
+            continue
+        text, was_summarized = _section(name, value, PROMPT_SERIES_MAX_ROWS)
+        if was_summarized:
+            summarized.append(name)
+        relevant = not question_words or _related(question_words, name)
+        sections.append({"name": name, "text": text, "relevant": relevant})
+
+    def total():
+        return estimate_tokens("\n".join(section["text"] for section in sections))
+
+    dropped = []
+    # Largest unrelated sections go first
+    for section in sorted([s for s in sections if not s["relevant"]], key=lambda s: -len(s["text"])):
+        if total() <= budget:
+            break
+        sections.remove(section)
+        dropped.append(section["name"])
+
+    summarized = [name for name in summarized if name not in dropped]
+    text = "\n".join(section["text"] for section in sections)
+    truncated = estimate_tokens(text) > budget
+    if truncated:
+        text = text[:budget * 4].rsplit("\n", 1)[0] + "\n[truncated]"
+
+    report = {
+        "label": label,
+        "at": time.time(),
+        "original_bytes": len(original.encode("utf-8")),
+        "compact_bytes": len(text.encode("utf-8")),
+        "original_tokens": estimate_tokens(original),
+        "compact_tokens": estimate_tokens(text),
+        "summarized": summarized,
+        "dropped": dropped,
+        "truncated": truncated,
+    }
+    report["tokens_saved"] = report["original_tokens"] - report["compact_tokens"]
+    logger.info(
+        "Prompt data%s: %d -> %d tokens, %d -> %d bytes (dropped: %s, summarized: %s)",
+        f" for {label}" if label else "", report["original_tokens"], report["compact_tokens"],
+        report["original_bytes"], report["compact_bytes"], ", ".join(dropped) or "none",
+        ", ".join(summarized) or "none",
+    )
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["original_tokens"] += report["original_tokens"]
+        _stats["compact_tokens"] += report["compact_tokens"]
+        _stats["sections_dropped"] += len(dropped)
+        _stats["series_summarized"] += len(summarized)
+        _recent.append(report)
+    return text, report
+
+
+def compaction_stats() -> dict:
+    """
+    Running totals plus the most recent per-request reports, newest first.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["recent"] = list(reversed(_recent))
+    stats["tokens_saved"] = stats["original_tokens"] - stats["compact_tokens"]
+    return stats
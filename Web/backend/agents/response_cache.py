@@ -0,0 +1,198 @@
+import os
+import json
+import asyncio
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# In-memory tier: bounded LRU shared by every agent in this worker
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "300"))
+# Optional on-disk tier. Point every uvicorn worker at the same file to share it.
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")
+# Minimum seconds between sweeps of expired rows from the on-disk tier
+LLM_CACHE_SWEEP_INTERVAL = float(os.getenv("LLM_CACHE_SWEEP_INTERVAL", "300"))
+
+# Per-endpoint TTLs in seconds; override with e.g. LLM_CACHE_TTL_GENERATE_INSIGHT=60
+ENDPOINT_TTLS = {
+    "generate-insight": 300,
+    "what-if-analysis": 600,
+    "what-if-batch": 600,
+    "what-if-sensitivity": 600,
+    "generate-marketing-insight": 300,
+    "analyze-campaign-strategy": 600,
+    "generate-operations-insight": 300,
+    "marketing-plan": 3600,
+}
+for _endpoint in ENDPOINT_TTLS:
+    _override = os.getenv("LLM_CACHE_TTL_" + _endpoint.upper().replace("-", "_"))
+    if _override:
+        ENDPOINT_TTLS[_endpoint] = float(_override)
+
+
+def make_key(endpoint: str, model: str, system_prompt: str, data, question=None) -> str:
+    """
+    Canonical hash of a request. Dict key order in `data` does not affect the key.
+    """
+    payload = json.dumps(
+        {
+            "endpoint": endpoint,
+            "model": model,
+            "system": system_prompt,
+            "data": data,
+            "question": question,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache for LLM responses with an optional SQLite tier.
+
+    Async code should use aget/aput, which run the SQLite tier in a worker
+    thread so disk I/O never blocks the event loop. The memory tier and the
+    disk tier have separate locks, so memory hits never wait on SQLite.
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, db_path=LLM_CACHE_DB):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "disk_hits": 0, "evictions": 0, "expirations": 0}
+        self._endpoint_stats = {}
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._last_sweep = 0.0
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, endpoint TEXT, value TEXT, expires_at REAL)"
+            )
+            self._db.commit()
+
+    def _count(self, endpoint, outcome):
+        self._stats[outcome] += 1
+        if endpoint:
+            counters = self._endpoint_stats.setdefault(endpoint, {"hits": 0, "misses": 0})
+            counters[outcome] += 1
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            return None
+
+    def _disk_get(self, key):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        with self._lock:
+            self._store(key, row[0], row[1])
+            self._stats["disk_hits"] += 1
+        return row[0]
+
+    def _record(self, endpoint, value):
+        with self._lock:
+            self._count(endpoint, "misses" if value is None else "hits")
+        return value
+
+    def _disk_put(self, key, value, endpoint, expires_at):
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, value, expires_at) VALUES (?, ?, ?, ?)",
+                (key, endpoint, value, expires_at),
+            )
+            # Expired rows are swept at most once per interval, not on every write
+            if now - self._last_sweep >= LLM_CACHE_SWEEP_INTERVAL:
+                self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+                self._last_sweep = now
+            self._db.commit()
+
+    def _memory_put(self, key, value, endpoint):
+        expires_at = time.time() + ENDPOINT_TTLS.get(endpoint, LLM_CACHE_TTL)
+        with self._lock:
+            self._store(key, value, expires_at)
+        return expires_at
+
+    def get(self, key: str, endpoint: str = None):
+        """
+        Returns the cached value for `key`, or None on a miss.
+        """
+        value = self._memory_get(key)
+        if value is None and self._db is not None:
+            value = self._disk_get(key)
+        return self._record(endpoint, value)
+
+    async def aget(self, key: str, endpoint: str = None):
+        """
+        Async get(); a memory miss falls through to the SQLite tier in a worker thread.
+        """
+        value = self._memory_get(key)
+        if value is None and self._db is not None:
+            value = await asyncio.to_thread(self._disk_get, key)
+        return self._record(endpoint, value)
+
+    def put(self, key: str, value: str, endpoint: str = None):
+        """
+        Stores `value` under `key` with the endpoint's TTL.
+        """
+        expires_at = self._memory_put(key, value, endpoint)
+        if self._db is not None:
+            self._disk_put(key, value, endpoint, expires_at)
+
+    async def aput(self, key: str, value: str, endpoint: str = None):
+        """
+        Async put(); the SQLite write runs in a worker thread.
+        """
+        expires_at = self._memory_put(key, value, endpoint)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_put, key, value, endpoint, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "disk_tier": self._db is not None,
+                "endpoints": {name: dict(counters) for name, counters in self._endpoint_stats.items()},
+            }
+
+
+response_cache = ResponseCache()
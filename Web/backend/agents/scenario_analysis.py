@@ -0,0 +1,109 @@
+import os
+import numpy as np
+from agents.cashflow_analytics import cashflow_arrays, parse_number, _value
+
+# Accepted spellings of the scenario drivers, as sent by the dashboard and older clients
+REVENUE_KEYS = ("monthlyRevenue", "Monthly revenue", "revenue", "income")
+EXPENSE_KEYS = ("monthlyExpenses", "Monthly expenses", "expenses")
+RANK_FIELDS = ("profit", "margin_pct", "profit_change")
+# Upper bound on scenarios per batch request
+WHAT_IF_MAX_SCENARIOS = int(os.getenv("WHAT_IF_MAX_SCENARIOS", "500"))
+
+
+def _number_field(scenario, key):
+    """parse_number of scenario[key]; None when absent or blank, ValueError when not a number"""
+    raw = scenario.get(key)
+    if raw is None or (isinstance(raw, str) and not raw.strip()):
+        return None
+    value = parse_number(raw)
+    if value is None:
+        raise ValueError(f"'{key}' must be a number, got {raw!r}")
+    return value
+
+
+def _driver(scenario, keys, change_key, base):
+    for key in keys:
+        value = _number_field(scenario, key)
+        if value is not None:
+            return value
+    change = _number_field(scenario, change_key) if change_key else None
+    return base * (1 + change / 100) if change is not None else base
+
+
+def baseline(original_data: dict) -> dict:
+    """
+    Average monthly revenue and expenses of original_data["cashflowData"],
+    falling back to top-level monthly revenue/expense fields.
+    """
+    arrays = cashflow_arrays(original_data)
+    if len(arrays["months"]):
+        return {"revenue": float(arrays["income"].mean()), "expenses": float(arrays["expenses"].mean())}
+    return {
+        "revenue": _driver(original_data, REVENUE_KEYS, None, 0.0),
+        "expenses": _driver(original_data, EXPENSE_KEYS, None, 0.0),
+    }
+
+
+def evaluate_scenarios(original_data: dict, scenarios: list, rank_by: str = "profit") -> dict:
+    """
+    Computes profit, margin and break-even deltas of every scenario against the
+    baseline in one vectorized pass and ranks them by `rank_by`.
+
+    A scenario sets monthly revenue/expenses directly (e.g. "monthlyRevenue")
+    or relative to the baseline with "revenue_change_pct"/"expense_change_pct";
+    drivers it leaves out stay at the baseline.
+    """
+    base = baseline(original_data)
+    drivers = []
+    for i, s in enumerate(scenarios):
+        try:
+            drivers.append((
+                _driver(s, REVENUE_KEYS, "revenue_change_pct", base["revenue"]),
+                _driver(s, EXPENSE_KEYS, "expense_change_pct", base["expenses"]),
+            ))
+        except ValueError as e:
+            raise ValueError(f"{s.get('name') or f'Scenario {i + 1}'}: {e}") from None
+    revenue = np.array([driver[0] for driver in drivers])
+    expenses = np.array([driver[1] for driver in drivers])
+
+    base_profit = base["revenue"] - base["expenses"]
+    base_margin = base_profit / base["revenue"] * 100 if base["revenue"] else np.nan
+    profit = revenue - expenses
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margin = np.where(revenue != 0, profit / revenue * 100, np.nan)
+    profit_change_pct = (profit - base_profit) / abs(base_profit) * 100 if base_profit else np.full(len(profit), np.nan)
+    # Break-even revenue equals expenses here; the shift is how much more (or
+    # less) revenue the scenario needs to avoid a loss
+    break_even_shift = expenses - base["expenses"]
+
+    columns = {
+        "revenue": revenue,
+        "expenses": expenses,
+        "profit": profit,
+        "profit_change": profit - base_profit,
+        "profit_change_pct": profit_change_pct,
+        "margin_pct": margin,
+        "margin_change_pts": margin - base_margin,
+        "break_even_revenue": expenses,
+        "break_even_shift": break_even_shift,
+    }
+    key = np.nan_to_num(columns[rank_by], nan=-np.inf)
+    order = np.argsort(-key, kind="stable")
+
+    ranked = []
+    for rank, i in enumerate(order, start=1):
+        entry = {"rank": rank, "name": scenarios[i].get("name") or f"Scenario {i + 1}", "index": int(i)}
+        entry.update({name: _value(column[i]) for name, column in columns.items()})
+        entry["loss_making"] = bool(profit[i] < 0)
+        ranked.append(entry)
+
+    return {
+        "baseline": {
+            "revenue": _value(base["revenue"]),
+            "expenses": _value(base["expenses"]),
+            "profit": _value(base_profit),
+            "margin_pct": _value(base_margin),
+        },
+        "rank_by": rank_by,
+        "scenarios": ranked,
+    }
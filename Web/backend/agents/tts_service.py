@@ -0,0 +1,150 @@
+import os
+import uuid
+import queue
+import hashlib
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import pyttsx3
+from agents.workspace import evict_lru
+
+TTS_RATE = int(os.getenv("TTS_RATE", "160"))
+TTS_VOLUME = float(os.getenv("TTS_VOLUME", "1.0"))
+# Index into the engine's voice list; 1 is usually a female voice
+TTS_VOICE_INDEX = int(os.getenv("TTS_VOICE_INDEX", "1"))
+# Seconds a batch may take before the engine is assumed hung and replaced
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "120"))
+# Narration audio kept on disk before least recently used files are evicted
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+# Audio used more recently than this is never evicted, so a render in progress keeps its narration
+TTS_CACHE_MIN_AGE = float(os.getenv("TTS_CACHE_MIN_AGE", "3600"))
+
+
+class TTSService:
+    """
+    Keeps one pyttsx3 engine alive on a dedicated thread.
+
+    synthesize_batch() queues every line of a job and the worker renders them
+    all in a single runAndWait(). Audio is cached on disk by a hash of
+    (text, voice, rate), so repeated narration is never synthesized twice.
+
+    runAndWait() can hang; a batch that takes longer than `timeout` fails and
+    the engine thread is abandoned and replaced, with queued batches moved
+    to the new thread.
+    """
+
+    def __init__(self, cache_dir, rate=TTS_RATE, volume=TTS_VOLUME, voice_index=TTS_VOICE_INDEX,
+                 timeout=TTS_TIMEOUT, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.rate = rate
+        self.volume = volume
+        self.voice_index = voice_index
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._start_worker()
+
+    def _start_worker(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._worker, args=(self._generation, self._queue), name="tts-engine", daemon=True
+        )
+        self._thread.start()
+
+    def _restart(self, generation):
+        """Abandon a hung engine thread and move its pending batches to a new one"""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._generation += 1
+            stale = self._queue
+            self._start_worker()
+            while True:
+                try:
+                    self._queue.put(stale.get_nowait())
+                except queue.Empty:
+                    break
+        print("TTS engine timed out; started a new engine thread")
+
+    def _init_engine(self):
+        # A fresh Engine rather than pyttsx3.init(), which hands back the cached (possibly hung) one
+        engine = pyttsx3.Engine()
+        engine.setProperty('rate', self.rate)
+        engine.setProperty('volume', self.volume)
+        voices = engine.getProperty('voices')
+        if len(voices) > self.voice_index:
+            engine.setProperty('voice', voices[self.voice_index].id)
+        return engine
+
+    def audio_path(self, text):
+        key = hashlib.sha256(f"{text}|{self.voice_index}|{self.rate}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _worker(self, generation, jobs_queue):
+        engine = None
+        while generation == self._generation:
+            jobs, future = jobs_queue.get()
+            if generation != self._generation:
+                # Replaced while this batch was waiting; hand it to the new thread
+                self._queue.put((jobs, future))
+                break
+            tmp_paths = []
+            try:
+                if engine is None:
+                    engine = self._init_engine()
+                for text, path in jobs:
+                    tmp_path = f"{path}.{uuid.uuid4().hex}.part.mp3"
+                    engine.save_to_file(text, tmp_path)
+                    tmp_paths.append((tmp_path, path))
+                engine.runAndWait()
+                for tmp_path, path in tmp_paths:
+                    if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+                        os.replace(tmp_path, path)
+                if not future.done():
+                    future.set_result(None)
+            except Exception as e:
+                # A wedged engine is rebuilt on the next batch
+                engine = None
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                for tmp_path, _ in tmp_paths:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+    def synthesize_batch(self, texts):
+        """
+        Returns one audio path per text (None where synthesis failed).
+        Cached lines are returned immediately; the rest are rendered in one run.
+        """
+        paths = [self.audio_path(text) for text in texts]
+        missing = {}
+        for text, path in zip(texts, paths):
+            if not text:
+                continue
+            if os.path.exists(path):
+                # Refresh the mtime so LRU eviction keeps narration that is still in use
+                os.utime(path)
+            else:
+                missing[path] = text
+
+        if missing:
+            future = Future()
+            with self._lock:
+                generation = self._generation
+                self._queue.put(([(text, path) for path, text in missing.items()], future))
+            try:
+                future.result(timeout=self.timeout)
+            except FutureTimeout:
+                print(f"Error generating audio: no result after {self.timeout}s")
+                self._restart(generation)
+            except Exception as e:
+                print(f"Error generating audio: {e}")
+            self.evict()
+
+        return [path if text and os.path.exists(path) else None for text, path in zip(texts, paths)]
+
+    def evict(self):
+        """Delete least recently used audio until the cache fits in max_bytes"""
+        evict_lru(self.cache_dir, ".mp3", self.max_bytes, TTS_CACHE_MIN_AGE)
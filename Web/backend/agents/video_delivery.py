@@ -0,0 +1,187 @@
+import os
+import sqlite3
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+import anyio
+from starlette.responses import Response
+from agents.clip_cache import _sha256_file
+
+CHUNK_SIZE = 256 * 1024
+# Rendered outputs get unique names and never change, so clients and CDNs may keep them
+VIDEO_CACHE_CONTROL = os.getenv("VIDEO_CACHE_CONTROL", "public, max-age=31536000, immutable")
+
+
+class OutputIndex:
+    """
+    Maps job ids and file names of rendered videos to absolute path, size and hash.
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outputs ("
+            "name TEXT PRIMARY KEY, job_id TEXT, path TEXT, size INTEGER, sha256 TEXT, mtime REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS outputs_job_id ON outputs (job_id)")
+        self._db.commit()
+
+    def register(self, path, job_id=None):
+        """
+        Records a finished video. Returns its index entry.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = {
+            "name": os.path.basename(path),
+            "job_id": job_id,
+            "path": path,
+            "size": stat.st_size,
+            "sha256": _sha256_file(path),
+            "mtime": stat.st_mtime,
+        }
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO outputs (name, job_id, path, size, sha256, mtime) "
+                "VALUES (:name, :job_id, :path, :size, :sha256, :mtime)",
+                entry,
+            )
+            self._db.commit()
+        return entry
+
+    def lookup(self, key):
+        """
+        Finds a video by file name or job id. Entries whose file has been
+        removed (e.g. by the workspace sweeper) are dropped.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM outputs WHERE name = ? OR job_id = ? ORDER BY mtime DESC LIMIT 1", (key, key)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        if not os.path.exists(entry["path"]) or os.path.getsize(entry["path"]) != entry["size"]:
+            with self._lock:
+                self._db.execute("DELETE FROM outputs WHERE name = ?", (entry["name"],))
+                self._db.commit()
+            return None
+        return entry
+
+
+def _parse_range(header, size):
+    """
+    Parses a single `bytes=` range. Returns (start, end) inclusive, None to
+    serve the whole file, or "unsatisfiable".
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start == "":
+            length = int(end)
+            if length == 0 or size == 0:
+                return "unsatisfiable"
+            return max(0, size - length), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    # Checked before end < start: "bytes=1000-" on a 1000-byte file has end 999
+    if start >= size:
+        return "unsatisfiable"
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+class FileRangeResponse(Response):
+    """
+    Sends a byte range of a file. Uses the ASGI zero-copy send extension when
+    the server offers it, otherwise streams the range in chunks off the loop.
+    """
+
+    def __init__(self, path, start, length, status_code, headers, send_body=True):
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.start = start
+        self.length = length
+        self.send_body = send_body
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopysend" in extensions:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+                return
+
+            f.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def video_response(request, entry, media_type="video/mp4"):
+    """
+    Builds a cache-aware response for an indexed video, honouring
+    If-None-Match, If-Modified-Since, Range and If-Range.
+    """
+    size = entry["size"]
+    etag = f'"{entry["sha256"][:32]}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(entry["mtime"], usegmt=True),
+        "Cache-Control": VIDEO_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "Content-Type": media_type,
+        "Content-Disposition": f'attachment; filename="{entry["name"]}"',
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and not if_none_match:
+        try:
+            if int(entry["mtime"]) <= parsedate_to_datetime(if_modified_since).timestamp():
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    byte_range = _parse_range(request.headers.get("range"), size)
+    if_range = request.headers.get("if-range")
+    if byte_range is not None and if_range and if_range.strip() != etag:
+        # The client's copy is stale; send the whole file
+        byte_range = None
+
+    send_body = request.method != "HEAD"
+    if byte_range == "unsatisfiable":
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return FileRangeResponse(entry["path"], 0, size, 200, headers, send_body)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return FileRangeResponse(entry["path"], start, end - start + 1, 206, headers, send_body)
@@ -1,28 +1,34 @@
 import os
+import re
 import json
 import requests
 import numpy as np
-import pyttsx3
-from groq import Groq
-from dotenv import load_dotenv
 from PIL import Image, ImageDraw, ImageFont
-from moviepy import VideoFileClip, ImageClip, CompositeVideoClip, concatenate_videoclips, AudioFileClip
+from moviepy import (VideoFileClip, ImageClip, CompositeVideoClip, concatenate_videoclips, AudioFileClip, AudioClip,
+                     CompositeAudioClip)
+import time
+import uuid
+import shutil
 import tempfile
 from pathlib import Path
-
-load_dotenv()
-
+from functools import lru_cache
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from agents.llm_gateway import complete
+from agents.response_cache import make_key, response_cache
+from agents.clip_cache import ClipCache
+from agents.workspace import job_workspace
+from agents.tts_service import TTSService
+from agents.memory_monitor import RssMonitor
+from agents import ffmpeg_render
+
+# The gateway import above has already loaded .env
 PEXELS_KEY = os.getenv("PEXELS_API_KEY")
-GROQ_KEY = os.getenv("GROQ_API_KEY")
-
-if not GROQ_KEY:
-    raise ValueError("GROQ_API_KEY not found in .env file")
 
 if not PEXELS_KEY:
     raise ValueError("PEXELS_API_KEY not found in .env file")
 
-client = Groq(api_key=GROQ_KEY)
-
 # Create output directory
 # Use relative path that works both from project root and backend directory
 OUTPUT_DIR = os.path.join(os.getcwd(), "marketing_videos")
@@ -38,9 +44,130 @@ if not os.path.exists(OUTPUT_DIR):
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(f"{OUTPUT_DIR}/temp", exist_ok=True)
 
+# Pexels I/O tuning. PEXELS_API_URL can point at a local stub server for testing.
+PEXELS_API_URL = os.getenv("PEXELS_API_URL", "https://api.pexels.com/videos/search")
+PEXELS_MAX_WORKERS = int(os.getenv("PEXELS_MAX_WORKERS", "5"))
+PEXELS_CONNECT_TIMEOUT = float(os.getenv("PEXELS_CONNECT_TIMEOUT", "5"))
+PEXELS_SEARCH_TIMEOUT = float(os.getenv("PEXELS_SEARCH_TIMEOUT", "10"))
+PEXELS_DOWNLOAD_TIMEOUT = float(os.getenv("PEXELS_DOWNLOAD_TIMEOUT", "30"))
+
+# One pooled session for every search and download, so keep-alive connections
+# to the Pexels API and CDN are reused across clips and jobs
+http = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(PEXELS_MAX_WORKERS * 2, 10))
+http.mount("https://", _adapter)
+http.mount("http://", _adapter)
+
+# "ffmpeg" renders the reel as a single filter graph; "moviepy" composites in Python
+VIDEO_RENDER_BACKEND = os.getenv("VIDEO_RENDER_BACKEND", "ffmpeg")
+# Encode each clip segment in its own ffmpeg process and stream-copy concat them
+VIDEO_RENDER_PARALLEL = os.getenv("VIDEO_RENDER_PARALLEL", "1") == "1"
+# MoviePy renders one segment at a time and joins them, instead of one composite of every clip
+VIDEO_RENDER_STREAMING = os.getenv("VIDEO_RENDER_STREAMING", "1") == "1"
+
+# Named output settings selectable per request. "draft" is for checking
+# captions and pacing quickly; "final" is the high-bitrate delivery render.
+RENDER_PROFILES = {
+    "draft": {"width": 540, "height": 960, "fps": 15, "preset": "ultrafast", "crf": 30, "bitrate": None},
+    "standard": {"width": 1080, "height": 1920, "fps": 30, "preset": ffmpeg_render.X264_PRESET, "crf": 23, "bitrate": None},
+    "final": {"width": 1080, "height": 1920, "fps": 30, "preset": "slow", "crf": 18, "bitrate": "8000k"},
+}
+
+# Stock clips are always selected for the largest profile frame, so clips fetched
+# for a draft can be reused when it is promoted; smaller profiles scale down at decode
+CLIP_TARGET_SIZE = (
+    max(settings["width"] for settings in RENDER_PROFILES.values()),
+    max(settings["height"] for settings in RENDER_PROFILES.values()),
+)
+
+PLAN_MODEL = "llama-3.3-70b-versatile"
+# Part of the plan cache key; bump it when the plan prompt changes
+PLAN_PROMPT_VERSION = "1"
+
+# Aspect ratios a reel can be delivered in. The short side of each frame is
+# the render profile's width, so "9:16" is the profile's own frame.
+OUTPUT_FORMATS = {"9:16": (9, 16), "1:1": (1, 1), "16:9": (16, 9)}
+
+# Number of rendered caption overlays kept in memory
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_SIZE", "128"))
+
+# Downloaded stock clips and search results, shared by every job
+clip_cache = ClipCache(os.path.join(OUTPUT_DIR, "cache"))
+
+# Encoded reel segments, so edits only re-encode what changed
+SEGMENT_CACHE_DIR = os.path.join(OUTPUT_DIR, "cache", "segments")
+os.makedirs(SEGMENT_CACHE_DIR, exist_ok=True)
+
+# Progressive HLS playlists, one directory per job
+HLS_DIR = os.path.join(OUTPUT_DIR, "hls")
+os.makedirs(HLS_DIR, exist_ok=True)
+
+# One long-lived TTS engine; narration audio is cached next to the clips
+tts = TTSService(os.path.join(OUTPUT_DIR, "cache", "tts"))
+
+
+def _normalize_brand_type(brand_type):
+    return " ".join(str(brand_type).lower().split())
+
+
+def _as_text_list(value, keep_empty=False):
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        return []
+    items = ["" if item is None else str(item).strip() for item in value]
+    # Captions and narration are positional, so their blanks are kept
+    return items if keep_empty else [item for item in items if item]
+
+
+def repair_marketing_plan(content):
+    """Parse a plan response and repair what can be fixed locally.
+
+    Strips Markdown fences and surrounding prose, then makes `captions` and
+    `voiceover` exactly as long as `search_terms` (missing captions fall back
+    to the search term, missing narration is left silent). Raises ValueError
+    if there are no search terms or no CTA.
+    """
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", content, re.DOTALL)
+    if fenced:
+        content = fenced.group(1)
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("Plan response contains no JSON object")
+    plan = json.loads(content[start:end + 1])
+    if not isinstance(plan, dict):
+        raise ValueError("Plan response is not a JSON object")
+
+    cta = plan.get("cta")
+    if isinstance(cta, list):
+        cta = " ".join(_as_text_list(cta))
+    if not cta or not str(cta).strip():
+        raise ValueError("Plan has no call to action")
+
+    # The three lists are aligned by position, so blanks are dropped from all of them together
+    terms = _as_text_list(plan.get("search_terms"), keep_empty=True)
+    captions = _as_text_list(plan.get("captions"), keep_empty=True)[:len(terms)]
+    captions += [""] * (len(terms) - len(captions))
+    voiceover = _as_text_list(plan.get("voiceover"), keep_empty=True)[:len(terms)]
+    voiceover += [""] * (len(terms) - len(voiceover))
+    rows = [(term, caption or term.title(), line) for term, caption, line in zip(terms, captions, voiceover) if term]
+    if not rows:
+        raise ValueError("Plan has no search terms")
+    search_terms, captions, voiceover = (list(column) for column in zip(*rows))
+    return {"search_terms": search_terms, "captions": captions, "voiceover": voiceover, "cta": str(cta).strip()}
+
 
 def generate_marketing_plan(brand_type):
-    """Generate marketing plan using Groq"""
+    """Generate marketing plan using Groq.
+
+    Uses JSON mode and repair_marketing_plan(), and caches plans per
+    normalized brand type for the "marketing-plan" TTL.
+    """
+    cache_key = make_key("marketing-plan", PLAN_MODEL, PLAN_PROMPT_VERSION, _normalize_brand_type(brand_type))
+    cached = response_cache.get(cache_key, "marketing-plan")
+    if cached is not None:
+        return json.loads(cached)
+
     prompt = f"""
 You are a social media marketing expert.
 
@@ -64,23 +191,42 @@ Rules:
 """
 
     try:
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
+        content = complete(
+            [{"role": "user", "content": prompt}],
+            model=PLAN_MODEL,
+            temperature=0.7,
+            response_format={"type": "json_object"}
         )
-        content = response.choices[0].message.content
-        return json.loads(content)
+        plan = repair_marketing_plan(content)
     except Exception as e:
         print(f"Error from Groq API or JSON parsing: {e}")
-        if 'response' in locals():
-            print(f"Groq API raw response: {getattr(response, 'choices', None)}")
+        if 'content' in locals():
+            print(f"Groq API raw response: {content}")
         raise
 
+    response_cache.put(cache_key, json.dumps(plan), "marketing-plan")
+    return plan
 
-def fetch_pexels_videos(query, count=3):
-    """Fetch videos from Pexels API"""
-    url = "https://api.pexels.com/videos/search"
+
+def select_rendition(video_files, width=1080, height=1920):
+    """Pick the smallest rendition that still covers a width x height frame.
+
+    A rendition covers the frame if scaling it to fill the frame never
+    upscales, i.e. it is at least as wide and as tall as the target. If none
+    does, the largest available rendition is used.
+    """
+    sized = [f for f in video_files if f.get("width") and f.get("height")]
+    if not sized:
+        return video_files[0]
+    covering = [f for f in sized if f["width"] >= width and f["height"] >= height]
+    if covering:
+        return min(covering, key=lambda x: x["width"] * x["height"])
+    return max(sized, key=lambda x: x["width"] * x["height"])
+
+
+def fetch_pexels_videos(query, count=3, target_size=(1080, 1920)):
+    """Fetch videos from Pexels API, choosing a rendition sized for `target_size`"""
+    url = PEXELS_API_URL
     headers = {"Authorization": PEXELS_KEY}
     params = {
         "query": query, 
@@ -88,25 +234,41 @@ def fetch_pexels_videos(query, count=3):
         "orientation": "portrait"
     }
 
-    try:
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
-        if resp.status_code != 200:
-            print(f"Pexels API error: {resp.status_code} {resp.text}")
+    # The search cache holds every rendition, so any target size can be served from it
+    results = clip_cache.get_search(query, params["orientation"], count)
+    if results is None or any("files" not in v for v in results):
+        try:
+            resp = http.get(url, headers=headers, params=params, timeout=(PEXELS_CONNECT_TIMEOUT, PEXELS_SEARCH_TIMEOUT))
+            if resp.status_code != 200:
+                print(f"Pexels API error: {resp.status_code} {resp.text}")
+                return []
+            res = resp.json()
+        except Exception as e:
+            print(f"Error fetching from Pexels: {e}")
             return []
-        res = resp.json()
-    except Exception as e:
-        print(f"Error fetching from Pexels: {e}")
-        return []
+
+        results = [
+            {
+                "id": v["id"],
+                "duration": v["duration"],
+                "files": [
+                    {"link": f["link"], "width": f.get("width"), "height": f.get("height"), "quality": f.get("quality")}
+                    for f in v["video_files"]
+                ]
+            }
+            for v in res.get("videos", []) if v.get("video_files")
+        ]
+        if results:
+            clip_cache.put_search(query, params["orientation"], count, results)
 
     videos = []
-    for v in res.get("videos", []):
-        hd_files = [f for f in v["video_files"] if f["quality"] == "hd"]
-        if hd_files:
-            best = max(hd_files, key=lambda x: x["width"])
-        else:
-            best = max(v["video_files"], key=lambda x: x["width"])
+    for v in results:
+        best = select_rendition(v["files"], *target_size)
         videos.append({
+            "id": v["id"],
             "url": best["link"],
+            "width": best.get("width"),
+            "height": best.get("height"),
             "duration": v["duration"]
         })
 
@@ -116,213 +278,553 @@ def fetch_pexels_videos(query, count=3):
 def download_video(url, filename):
     """Download video from URL"""
     try:
-        r = requests.get(url, stream=True, timeout=30)
+        r = http.get(url, stream=True, timeout=(PEXELS_CONNECT_TIMEOUT, PEXELS_DOWNLOAD_TIMEOUT))
+        r.raise_for_status()
+        written = 0
         with open(filename, "wb") as f:
             for chunk in r.iter_content(chunk_size=8192):
                 if chunk:
                     f.write(chunk)
+                    written += len(chunk)
+        expected = r.headers.get("Content-Length")
+        if expected is not None and int(expected) != written:
+            print(f"Incomplete download: {written} of {expected} bytes")
+            return False
         return True
     except Exception as e:
         print(f"Error downloading video: {e}")
         return False
 
 
-def generate_audio(text, filename):
-    """Generate TTS audio using pyttsx3"""
+def fetch_clips(terms, label, progress=None, target_size=(1080, 1920)):
+    """Search and download one clip per term concurrently.
+
+    Returns the local clip paths in term order; terms whose search or
+    download fails are skipped rather than failing the whole batch.
+    Clips already in the clip cache are reused without any network transfer.
+    """
+    def fetch(i, term):
+        print(f"  Searching for: {term}")
+        videos = fetch_pexels_videos(term, count=3, target_size=target_size)
+        if not videos:
+            print(f"  ⚠️  No videos found for '{term}', skipping...")
+            return None
+        filename = clip_cache.fetch_clip(videos[0]["id"], videos[0]["url"], download_video)
+        if not filename:
+            return None
+        print(f"  ✓ Got {label} {i+1}")
+        return filename
+
+    with ThreadPoolExecutor(max_workers=PEXELS_MAX_WORKERS) as pool:
+        futures = [pool.submit(fetch, i, term) for i, term in enumerate(terms)]
+        results = []
+        for done, future in enumerate(futures, start=1):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"  ⚠️  Clip {done} failed: {e}")
+                results.append(None)
+            _report(progress, "download", 15 + 25 * done // len(futures))
+
+    return [filename for filename in results if filename]
+
+
+@lru_cache(maxsize=16)
+def load_font(name="arialbd.ttf", size=90):
+    """Load a TrueType font once per (name, size), falling back to PIL's default"""
     try:
-        engine = pyttsx3.init()
-        engine.setProperty('rate', 160)
-        engine.setProperty('volume', 1.0)
-        
-        voices = engine.getProperty('voices')
-        if len(voices) > 1:
-            engine.setProperty('voice', voices[1].id)
-        
-        engine.save_to_file(text, filename)
-        engine.runAndWait()
-        return True
-    except Exception as e:
-        print(f"Error generating audio: {e}")
-        return False
+        return ImageFont.truetype(name, size)
+    except:
+        return ImageFont.load_default()
 
 
-def create_bold_text_clip(text, size, duration, position='bottom'):
-    """Create bold, outlined text with background"""
-    width, height = size
-    img = Image.new("RGBA", size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
-    
-    try:
-        font = ImageFont.truetype("arialbd.ttf", 90)
-    except:
-        font = ImageFont.load_default()
-    
-    bbox = draw.textbbox((0, 0), text, font=font)
+@lru_cache(maxsize=CAPTION_CACHE_SIZE)
+def render_caption(text, frame_size, position='bottom', font_name="arialbd.ttf", font_size=None):
+    """Render a caption as a tight RGBA overlay.
+
+    Returns (pixels, (x, y)) where (x, y) is the overlay's top-left corner on
+    a frame of `frame_size`. Only the caption's bounding box is allocated, so
+    compositing touches a few hundred KB per frame instead of a full frame.
+    Sizes are designed for a 1920px-high frame and scale with the frame height.
+    """
+    width, height = frame_size
+    scale = height / 1920
+    font = load_font(font_name, font_size or round(90 * scale))
+
+    bbox = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox((0, 0), text, font=font)
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
-    
+
     x = (width - text_width) // 2
-    y = height - text_height - 100 if position == 'bottom' else (height - text_height) // 2
-    
-    # Draw background rectangle
-    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
-    overlay_draw = ImageDraw.Draw(overlay)
-    padding = 30
-    bg_bbox = [x - padding, y - padding, x + text_width + padding, y + text_height + padding]
-    overlay_draw.rounded_rectangle(bg_bbox, radius=20, fill=(0, 0, 0, 180))
-    img = Image.alpha_composite(img, overlay)
-    
-    # Draw text
+    y = height - text_height - round(100 * scale) if position == 'bottom' else (height - text_height) // 2
+
+    # Same layout as a full-frame layer, shifted so the background starts at (0, 0)
+    padding = round(30 * scale)
+    box_width = text_width + 2 * padding + 1
+    box_height = text_height + 2 * padding + 1
+    img = Image.new(
+        "RGBA",
+        (max(box_width, padding + bbox[2] + 1), max(box_height, padding + bbox[3] + 1)),
+        (0, 0, 0, 0)
+    )
     draw = ImageDraw.Draw(img)
-    draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
-    
-    # MOVIEPY V2 FIX: use .with_duration instead of .set_duration
-    return ImageClip(np.array(img)).with_duration(duration).with_opacity(0.95)
+    draw.rounded_rectangle([0, 0, box_width - 1, box_height - 1], radius=round(20 * scale), fill=(0, 0, 0, 180))
+    draw.text((padding, padding), text, font=font, fill=(255, 255, 255, 255))
 
+    pixels = np.array(img)
+    # Shared through the cache, so make sure no caller mutates it
+    pixels.setflags(write=False)
+    return pixels, (x - padding, y - padding)
 
-def build_marketing_video(video_files, captions, voiceovers, cta, output):
-    """Build the final marketing video"""
-    clips = []
-    
+
+def create_bold_text_clip(text, size, duration, position='bottom'):
+    """Create bold text with background, positioned on a frame of `size`"""
+    pixels, xy = render_caption(text, tuple(size), position)
+    # MOVIEPY V2 FIX: use .with_duration instead of .set_duration
+    return ImageClip(pixels).with_duration(duration).with_opacity(0.95).with_position(xy)
+
+
+def build_marketing_video(video_files, captions, voiceovers, cta, output, workspace=None, backend=None,
+                          profile="standard", hls_dir=None, formats=None):
+    """Build the final marketing video.
+
+    Intermediate files go to `workspace` (defaults to OUTPUT_DIR/temp), so
+    concurrent jobs with their own workspaces never share files. All narration
+    lines, including the CTA, are synthesized in one TTS batch up front.
+    `backend` selects "ffmpeg" or "moviepy" (default VIDEO_RENDER_BACKEND);
+    if the ffmpeg render fails the MoviePy path is used instead.
+    `profile` names an entry in RENDER_PROFILES.
+    With `hls_dir`, each segment is also published to an HLS playlist there
+    as soon as it is encoded, so playback can start before the render ends.
+    `formats` lists aspect ratios from OUTPUT_FORMATS (default ["9:16"]);
+    each is written to format_output_path(output, fmt) from one decode of
+    the clips and one narration mix.
+    """
+    workspace = workspace or f"{OUTPUT_DIR}/temp"
+    backend = backend or VIDEO_RENDER_BACKEND
+    profile = RENDER_PROFILES[profile]
+    outputs = [(fmt, format_output_path(output, fmt)) for fmt in formats or ["9:16"]]
+
+    *voice_files, cta_audio_file = tts.synthesize_batch(list(voiceovers[:len(video_files)]) + [cta])
+
+    if backend == "ffmpeg":
+        try:
+            _build_with_ffmpeg(video_files, captions, voice_files, cta, cta_audio_file, outputs, workspace, profile,
+                               hls_dir)
+            return
+        except Exception as e:
+            print(f"ffmpeg render failed, falling back to MoviePy: {e}")
+
+    if hls_dir:
+        # MoviePy cannot publish segments; drop the partial playlist so players stop waiting
+        shutil.rmtree(hls_dir, ignore_errors=True)
+
+    # MoviePy has no shared decode, so each format is rendered on its own
+    for fmt, path in outputs:
+        width, height = format_frame(fmt, profile)
+        _build_with_moviepy(video_files, captions, voice_files, cta, cta_audio_file, path,
+                            dict(profile, width=width, height=height), workspace)
+
+
+def _build_with_ffmpeg(video_files, captions, voice_files, cta, cta_audio_file, outputs, workspace, profile,
+                       hls_dir=None):
+    """Render subclip, scale, crop, captions, audio and concat as one ffmpeg filter graph.
+    `outputs` is a list of (format, path); the first one also feeds `hls_dir`.
+    """
+    frames = [format_frame(fmt, profile) for fmt, _ in outputs]
+    segments = []
     for i, file in enumerate(video_files):
         try:
-            clip = VideoFileClip(file)
-            
-            # MOVIEPY V2 FIX: subclip -> subclipped
-            clip_duration = min(4, clip.duration)
-            start_time = max(0, (clip.duration - clip_duration) / 2)
-            clip = clip.subclipped(start_time, start_time + clip_duration)
-            
-            # MOVIEPY V2 FIX: resize -> resized
-            clip = clip.resized(height=1920)
-            if clip.w > 1080:
-                clip = clip.cropped(x_center=clip.w/2, width=1080)
-            
-            audio_file = f"{OUTPUT_DIR}/temp/voice_{i}.mp3"
-            if generate_audio(voiceovers[i], audio_file):
-                audio = AudioFileClip(audio_file)
-                # MOVIEPY V2 FIX: set_audio -> with_audio
-                clip = clip.with_audio(audio)
-            
-            text_clip = create_bold_text_clip(
-                captions[i],
-                size=(1080, 1920),
-                duration=clip.duration,
-                position='bottom'
-            )
-            
-            final_clip = CompositeVideoClip([clip, text_clip])
-            clips.append(final_clip)
+            duration = ffmpeg_render.probe_duration(file)
         except Exception as e:
             print(f"Error processing clip {i}: {e}")
             continue
-    
-    if not clips:
+        clip_duration = min(4, duration)
+        overlays = []
+        for k, frame_size in enumerate(frames):
+            pixels, xy = render_caption(captions[i], frame_size, 'bottom')
+            overlay = os.path.join(workspace, f"caption_{i}.png" if k == 0 else f"caption_{i}_{k}.png")
+            Image.fromarray(pixels).save(overlay)
+            overlays.append((overlay, xy))
+        segments.append({
+            "caption": captions[i],
+            "source": file,
+            "start": max(0, (duration - clip_duration) / 2),
+            "duration": clip_duration,
+            "overlay": overlays[0][0],
+            "overlay_xy": overlays[0][1],
+            "overlays": overlays,
+            "audio": voice_files[i] if i < len(voice_files) else None,
+        })
+
+    if not segments:
         raise ValueError("No clips were successfully processed")
-    
-    base = concatenate_videoclips(clips, method="compose")
-    
-    cta_audio_file = f"{OUTPUT_DIR}/temp/voice_cta.mp3"
-    if generate_audio(cta, cta_audio_file):
-        cta_clip = create_bold_text_clip(
-            cta,
-            size=(1080, 1920),
-            duration=3,
-            position='center'
+
+    cta_segment = None
+    if cta_audio_file:
+        overlays = []
+        for k, frame_size in enumerate(frames):
+            pixels, xy = render_caption(cta, frame_size, 'center')
+            overlay = os.path.join(workspace, "caption_cta.png" if k == 0 else f"caption_cta_{k}.png")
+            Image.fromarray(pixels).save(overlay)
+            overlays.append((overlay, xy))
+        cta_segment = {
+            "caption": cta,
+            "background": ffmpeg_render.gradient_png(os.path.join(workspace, f"cta_bg_{frames[0][1]}.png"), *frames[0]),
+            "duration": 3,
+            "overlay": overlays[0][0],
+            "overlay_xy": overlays[0][1],
+            "overlays": overlays,
+            "audio": cta_audio_file,
+        }
+
+    playlist = None
+    if hls_dir:
+        durations = [segment["duration"] for segment in segments + ([cta_segment] if cta_segment else [])]
+        playlist = ffmpeg_render.HlsPlaylist(hls_dir, max(durations))
+
+    if len(outputs) > 1:
+        # Decode each clip once and encode every format from it
+        targets = [(width, height, path) for (width, height), (_, path) in zip(frames, outputs)]
+        if VIDEO_RENDER_PARALLEL or playlist:
+            ffmpeg_render.render_formats_parallel(
+                segments, cta_segment, targets, workspace, profile,
+                on_segment=playlist.append if playlist else None
+            )
+        else:
+            ffmpeg_render.render_reel_multi(segments, cta_segment, targets, profile)
+    # Progressive output needs per-segment encodes, so it always takes the parallel path
+    elif VIDEO_RENDER_PARALLEL or playlist:
+        reused = ffmpeg_render.render_reel_parallel(
+            segments, cta_segment, outputs[0][1], workspace, dict(profile, width=frames[0][0], height=frames[0][1]),
+            cache_dir=SEGMENT_CACHE_DIR, on_segment=playlist.append if playlist else None
         )
-        
-        gradient_bg = ImageClip(
-            np.tile(np.linspace(50, 150, 1920).reshape(1920, 1, 1), (1, 1080, 3)).astype('uint8')
-        ).with_duration(3) # MOVIEPY V2 FIX
-        
-        cta_composite = CompositeVideoClip([gradient_bg, cta_clip])
-        cta_audio = AudioFileClip(cta_audio_file)
-        cta_composite = cta_composite.with_audio(cta_audio) # MOVIEPY V2 FIX
-        
-        final = concatenate_videoclips([base, cta_composite])
+        if reused:
+            print(f"♻️  Reused {reused} cached segments")
+    else:
+        frame_profile = dict(profile, width=frames[0][0], height=frames[0][1])
+        ffmpeg_render.render_reel(segments, cta_segment, outputs[0][1], frame_profile)
+
+    if playlist:
+        playlist.finish()
+
+
+def _build_with_moviepy(video_files, captions, voice_files, cta, cta_audio_file, output, profile, workspace):
+    """Render the reel with MoviePy, one segment at a time unless VIDEO_RENDER_STREAMING is off"""
+    # The segment join needs an ffmpeg binary; without one render the whole reel in MoviePy
+    if VIDEO_RENDER_STREAMING and ffmpeg_render.ffmpeg_available():
+        _build_with_moviepy_streaming(video_files, captions, voice_files, cta, cta_audio_file, output, profile,
+                                      workspace)
     else:
-        final = base
-    
-    final.write_videofile(
+        _build_with_moviepy_composite(video_files, captions, voice_files, cta, cta_audio_file, output, profile)
+
+
+def _silence(duration):
+    return AudioClip(
+        lambda t: np.zeros((len(t), 2)) if np.ndim(t) else np.zeros(2),
+        duration=duration,
+        fps=ffmpeg_render.AUDIO_RATE
+    )
+
+
+def _fit_audio(audio, duration):
+    """Trim or pad a voiceover with silence to exactly `duration`, so segments join without drift"""
+    tracks = [_silence(duration)]
+    if audio is not None:
+        tracks.append(audio.subclipped(0, min(audio.duration, duration)))
+    return CompositeAudioClip(tracks).with_duration(duration)
+
+
+def _write_moviepy(clip, output, profile, extra_params=()):
+    params = ([] if profile["bitrate"] else ["-crf", str(profile["crf"])]) + list(extra_params)
+    clip.write_videofile(
         output,
-        fps=30,
+        fps=profile["fps"],
         codec="libx264",
         audio_codec="aac",
+        audio_fps=ffmpeg_render.AUDIO_RATE,
+        preset=profile["preset"],
+        bitrate=profile["bitrate"],
+        ffmpeg_params=params or None,
         logger=None
     )
-    
-    # Cleanup
-    for clip in clips: clip.close()
-    final.close()
 
-def generate_video(brand_type: str) -> dict:
-    """Main function to generate a marketing video"""
-    try:
-        print("🎬 Generating AI marketing plan...")
-        plan = generate_marketing_plan(brand_type)
 
-        video_files = []
+def _moviepy_segment(file, caption, audio_file, output, profile):
+    """Encode one clip segment; its video and audio readers are closed before returning"""
+    width, height = profile["width"], profile["height"]
+    with ExitStack() as stack:
+        source = stack.enter_context(VideoFileClip(file, target_resolution=(None, height)))
+        clip_duration = min(4, source.duration)
+        start_time = max(0, (source.duration - clip_duration) / 2)
+        clip = source.subclipped(start_time, start_time + clip_duration)
+        if clip.h != height:
+            clip = clip.resized(height=height)
+        if clip.w > width:
+            clip = clip.cropped(x_center=clip.w/2, width=width)
+
+        audio = stack.enter_context(AudioFileClip(audio_file)) if audio_file else None
+        clip = clip.with_audio(_fit_audio(audio, clip.duration))
+        text_clip = create_bold_text_clip(caption, size=(width, height), duration=clip.duration, position='bottom')
+        # Centre on a full frame so clips narrower than the format are pillarboxed, like the ffmpeg path
+        composite = stack.enter_context(
+            CompositeVideoClip([clip.with_position("center"), text_clip], size=(width, height))
+        )
+        # Same timescale as the ffmpeg backend, so segments stream-copy concat
+        _write_moviepy(composite, output, profile, ["-video_track_timescale", "90000"])
 
-        print("📥 Downloading videos from Pexels...")
-        for i, term in enumerate(plan["search_terms"]):
-            print(f"  Searching for: {term}")
-            videos = fetch_pexels_videos(term, count=3)
 
-            if not videos:
-                print(f"  ⚠️  No videos found for '{term}', skipping...")
+def _moviepy_cta_segment(cta, audio_file, output, profile):
+    """Encode the CTA card; its audio reader is closed before returning"""
+    width, height = profile["width"], profile["height"]
+    with ExitStack() as stack:
+        audio = stack.enter_context(AudioFileClip(audio_file))
+        gradient_bg = ImageClip(
+            np.tile(np.linspace(50, 150, height).reshape(height, 1, 1), (1, width, 3)).astype('uint8')
+        ).with_duration(3)
+        cta_clip = create_bold_text_clip(cta, size=(width, height), duration=3, position='center')
+        composite = stack.enter_context(CompositeVideoClip([gradient_bg, cta_clip]).with_audio(_fit_audio(audio, 3)))
+        _write_moviepy(composite, output, profile, ["-video_track_timescale", "90000"])
+
+
+def _build_with_moviepy_streaming(video_files, captions, voice_files, cta, cta_audio_file, output, profile,
+                                  workspace):
+    """Encode each segment separately with MoviePy, then stream-copy concat them.
+
+    Only one segment's sources are open at a time, so peak memory does not
+    grow with the number of clips.
+    """
+    paths = []
+    for i, file in enumerate(video_files):
+        path = os.path.join(workspace, f"moviepy_segment_{i}.mp4")
+        try:
+            _moviepy_segment(file, captions[i], voice_files[i] if i < len(voice_files) else None, path, profile)
+        except Exception as e:
+            print(f"Error processing clip {i}: {e}")
+            continue
+        paths.append(path)
+
+    if not paths:
+        raise ValueError("No clips were successfully processed")
+
+    if cta_audio_file:
+        path = os.path.join(workspace, "moviepy_segment_cta.mp4")
+        _moviepy_cta_segment(cta, cta_audio_file, path, profile)
+        paths.append(path)
+
+    ffmpeg_render.concat_segments(paths, output, os.path.join(workspace, "moviepy_segments.txt"))
+
+
+def _build_with_moviepy_composite(video_files, captions, voice_files, cta, cta_audio_file, output, profile):
+    """Decode, composite and encode the whole reel in one MoviePy graph"""
+    width, height = profile["width"], profile["height"]
+    # Every clip that owns a reader process, closed once the reel is written
+    readers = []
+    clips = []
+    final = None
+
+    try:
+        for i, file in enumerate(video_files):
+            try:
+                # Let ffmpeg scale while decoding so full-resolution frames never reach NumPy
+                clip = VideoFileClip(file, target_resolution=(None, height))
+                readers.append(clip)
+
+                # MOVIEPY V2 FIX: subclip -> subclipped
+                clip_duration = min(4, clip.duration)
+                start_time = max(0, (clip.duration - clip_duration) / 2)
+                clip = clip.subclipped(start_time, start_time + clip_duration)
+
+                # MOVIEPY V2 FIX: resize -> resized
+                if clip.h != height:
+                    clip = clip.resized(height=height)
+                if clip.w > width:
+                    clip = clip.cropped(x_center=clip.w/2, width=width)
+
+                audio_file = voice_files[i] if i < len(voice_files) else None
+                if audio_file:
+                    audio = AudioFileClip(audio_file)
+                    readers.append(audio)
+                    # MOVIEPY V2 FIX: set_audio -> with_audio
+                    clip = clip.with_audio(audio)
+
+                text_clip = create_bold_text_clip(
+                    captions[i],
+                    size=(width, height),
+                    duration=clip.duration,
+                    position='bottom'
+                )
+
+                # Centre on a full frame so every format keeps its size and the caption stays on-canvas
+                final_clip = CompositeVideoClip([clip.with_position("center"), text_clip], size=(width, height))
+                clips.append(final_clip)
+            except Exception as e:
+                print(f"Error processing clip {i}: {e}")
                 continue
 
-            filename = f"{OUTPUT_DIR}/temp/clip_{i}.mp4"
-            if download_video(videos[0]["url"], filename):
-                video_files.append(filename)
-                print(f"  ✓ Downloaded clip {i+1}")
-
-        if not video_files:
-            print("No video files downloaded. Using fallback search terms.")
-            fallback_terms = ["fashion", "clothing", "sale", "style", "trendy"]
-            for i, term in enumerate(fallback_terms):
-                print(f"  Fallback searching for: {term}")
-                videos = fetch_pexels_videos(term, count=3)
-                if not videos:
-                    print(f"  ⚠️  No fallback videos found for '{term}', skipping...")
-                    continue
-                filename = f"{OUTPUT_DIR}/temp/fallback_clip_{i}.mp4"
-                if download_video(videos[0]["url"], filename):
-                    video_files.append(filename)
-                    print(f"  ✓ Downloaded fallback clip {i+1}")
-
-        if not video_files:
-            return {
+        if not clips:
+            raise ValueError("No clips were successfully processed")
+
+        base = concatenate_videoclips(clips, method="compose")
+
+        if cta_audio_file:
+            cta_clip = create_bold_text_clip(
+                cta,
+                size=(width, height),
+                duration=3,
+                position='center'
+            )
+
+            gradient_bg = ImageClip(
+                np.tile(np.linspace(50, 150, height).reshape(height, 1, 1), (1, width, 3)).astype('uint8')
+            ).with_duration(3) # MOVIEPY V2 FIX
+
+            cta_composite = CompositeVideoClip([gradient_bg, cta_clip], size=(width, height))
+            cta_audio = AudioFileClip(cta_audio_file)
+            readers.append(cta_audio)
+            cta_composite = cta_composite.with_audio(cta_audio) # MOVIEPY V2 FIX
+
+            final = concatenate_videoclips([base, cta_composite], method="compose")
+        else:
+            final = base
+
+        _write_moviepy(final, output, profile)
+    finally:
+        # Cleanup, including the source and audio readers
+        for clip in clips + readers + ([final] if final is not None else []):
+            try:
+                clip.close()
+            except Exception:
+                pass
+
+def format_frame(fmt, profile):
+    """(width, height) of an OUTPUT_FORMATS aspect ratio at a render profile's size"""
+    across, down = OUTPUT_FORMATS[fmt]
+    short = min(profile["width"], profile["height"])
+    if across <= down:
+        return short, round(short * down / across / 2) * 2
+    return round(short * across / down / 2) * 2, short
+
+
+def format_output_path(output, fmt):
+    """Output path for one format; the default 9:16 keeps `output` unchanged"""
+    if fmt == "9:16":
+        return output
+    root, ext = os.path.splitext(output)
+    return f"{root}_{fmt.replace(':', 'x')}{ext}"
+
+
+def _report(progress, stage, percent):
+    """Forward a stage/percentage update to the caller's progress callback, if any"""
+    if progress is not None:
+        progress(stage, percent)
+
+
+def generate_video(brand_type: str, progress=None, job_id=None, profile="standard", plan=None, video_files=None,
+                   clip_size=None, progressive=False, formats=None) -> dict:
+    """Main function to generate a marketing video.
+
+    `progress`, if given, is called as progress(stage, percent) as the job advances.
+    Intermediate files live in a per-job workspace that is removed afterwards.
+    Passing the `plan` and `video_files` of an earlier (e.g. draft) render skips
+    the plan call and the downloads, so a preview can be promoted to a final
+    render cheaply; narration audio is reused from the TTS cache. `clip_size`
+    is the frame size those clips were selected for; they are only reused if
+    it covers this profile's frame. With `progressive`, segments are also
+    published as HLS under HLS_DIR/<job_id> while the render runs.
+    `formats` lists the OUTPUT_FORMATS to deliver (default ["9:16"]); they
+    share one plan, one set of clips and one narration, and the result's
+    `outputs` maps each format to its file. The result's `memory` field reports the process RSS at the start, peak
+    and end of the job.
+    """
+    job_id = job_id or uuid.uuid4().hex
+    with RssMonitor() as rss:
+        try:
+            with job_workspace(OUTPUT_DIR, job_id) as workspace:
+                result = _generate_video(brand_type, progress, job_id, workspace, profile, plan, video_files,
+                                         clip_size, progressive, formats or ["9:16"])
+        except Exception as e:
+            print(f"Error generating video: {e}")
+            import traceback
+            traceback.print_exc()
+            result = {
                 "status": "error",
-                "message": "Failed to download any video clips from both generated and fallback search terms."
+                "message": str(e)
             }
+    result["memory"] = rss.report()
+    if result["memory"]:
+        print(f"🧠 Job {job_id[:8]} RSS: {result['memory']}")
+    return result
+
+
+def _generate_video(brand_type, progress, job_id, workspace, profile, plan, video_files, clip_size, progressive,
+                    formats):
+    """Plan, fetch and render one video inside an already-created workspace"""
+    # Download the smallest renditions that cover the largest profile's frame
+    target_size = CLIP_TARGET_SIZE
+    frame = (RENDER_PROFILES[profile]["width"], RENDER_PROFILES[profile]["height"])
+    clips_cover_target = clip_size is not None and clip_size[0] >= frame[0] and clip_size[1] >= frame[1]
+
+    if plan is None:
+        print("🎬 Generating AI marketing plan...")
+        _report(progress, "plan", 5)
+        plan = generate_marketing_plan(brand_type)
+
+    if video_files and clips_cover_target and all(os.path.exists(file) for file in video_files):
+        print("♻️  Reusing previously fetched clips")
+        target_size = tuple(clip_size)
+    else:
+        print("📥 Downloading videos from Pexels...")
+        _report(progress, "download", 15)
+        video_files = fetch_clips(plan["search_terms"], "clip", progress, target_size)
+
+    if not video_files:
+        print("No video files downloaded. Using fallback search terms.")
+        fallback_terms = ["fashion", "clothing", "sale", "style", "trendy"]
+        video_files = fetch_clips(fallback_terms, "fallback clip", progress, target_size)
 
-        print(f"🎥 Building marketing video with {len(video_files)} clips...")
+    if not video_files:
+        return {
+            "status": "error",
+            "message": "Failed to download any video clips from both generated and fallback search terms."
+        }
+
+    print(f"🎥 Building marketing video with {len(video_files)} clips...")
+    _report(progress, "render", 40)
 
-        timestamp = int(__import__('time').time())
-        output_path = f"{OUTPUT_DIR}/video_{timestamp}.mp4"
+    timestamp = int(time.time())
+    output_path = f"{OUTPUT_DIR}/video_{timestamp}_{job_id[:8]}.mp4"
 
+    try:
         build_marketing_video(
             video_files=video_files,
             captions=plan["captions"][:len(video_files)],
             voiceovers=plan["voiceover"][:len(video_files)],
             cta=plan["cta"],
-            output=output_path
+            output=output_path,
+            workspace=workspace,
+            profile=profile,
+            hls_dir=os.path.join(HLS_DIR, job_id) if progressive else None,
+            formats=formats
         )
+    except Exception:
+        # Don't leave half-written videos behind
+        for fmt in formats:
+            if os.path.exists(format_output_path(output_path, fmt)):
+                os.remove(format_output_path(output_path, fmt))
+        raise
 
-        print(f"✅ Video created successfully!")
-
-        return {
-            "status": "success",
-            "video_path": output_path,
-            "duration": len(video_files) * 4 + 3,
-            "plan": plan
-        }
-    except Exception as e:
-        print(f"Error generating video: {e}")
-        import traceback
-        traceback.print_exc()
-        return {
-            "status": "error",
-            "message": str(e)
-        }
+    print(f"✅ Video created successfully!")
+    _report(progress, "done", 100)
+
+    outputs = {fmt: format_output_path(output_path, fmt) for fmt in formats}
+    return {
+        "status": "success",
+        "video_path": outputs[formats[0]],
+        "outputs": outputs,
+        "duration": len(video_files) * 4 + 3,
+        "plan": plan,
+        "profile": profile,
+        "clips": video_files,
+        "clip_size": list(target_size)
+    }
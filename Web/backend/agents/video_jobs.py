@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from agents.video_generation_agent import generate_video, OUTPUT_DIR
+from agents.video_delivery import OutputIndex
+
+# Number of videos rendered concurrently by this worker
+VIDEO_JOB_WORKERS = int(os.getenv("VIDEO_JOB_WORKERS", "2"))
+# Job state lives next to the rendered videos so it survives restarts
+VIDEO_JOB_DB = os.getenv("VIDEO_JOB_DB", os.path.join(OUTPUT_DIR, "video_jobs.db"))
+
+
+# Distinguishes this process from an earlier one that had the same pid
+# (common in containers, where the server is always pid 1)
+_PROCESS_TOKEN = uuid.uuid4().hex
+
+
+def _owner_alive(owner):
+    if not owner:
+        return False
+    pid, _, token = owner.partition(":")
+    pid = int(pid)
+    if pid == os.getpid():
+        return token == _PROCESS_TOKEN
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class VideoJobQueue:
+    """
+    Bounded worker pool for generate_video with job state persisted in SQLite.
+
+    Jobs move queued -> running -> succeeded | failed. A job is claimed with a
+    conditional UPDATE, so several uvicorn workers can share one database
+    without running the same job twice.
+    """
+
+    def __init__(self, db_path=VIDEO_JOB_DB, max_workers=VIDEO_JOB_WORKERS):
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT, stage TEXT, progress INTEGER, "
+            "params TEXT, result TEXT, error TEXT, owner TEXT, "
+            "created_at REAL, updated_at REAL)"
+        )
+        self._db.commit()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="video-job")
+        # Finished videos, looked up by /api/download-video
+        self.outputs = OutputIndex(db_path)
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            cursor = self._db.execute(sql, args)
+            self._db.commit()
+            return cursor.rowcount
+
+    def submit(self, params: dict) -> str:
+        """
+        Persists a new job and schedules it. Returns the job id immediately.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, status, stage, progress, params, created_at, updated_at) "
+            "VALUES (?, 'queued', 'queued', 0, ?, ?, ?)",
+            (job_id, json.dumps(params), now, now),
+        )
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def get(self, job_id: str):
+        """
+        Returns the job as a dict, or None if it does not exist.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"]) if job["params"] else {}
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        del job["owner"]
+        return job
+
+    def _progress(self, job_id, stage, percent):
+        self._execute(
+            "UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ?",
+            (stage, int(percent), time.time(), job_id),
+        )
+
+    def _run(self, job_id):
+        claimed = self._execute(
+            "UPDATE jobs SET status = 'running', owner = ?, updated_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (f"{os.getpid()}:{_PROCESS_TOKEN}", time.time(), job_id),
+        )
+        if not claimed:
+            return
+
+        job = self.get(job_id)
+        try:
+            result = generate_video(
+                **job["params"],
+                progress=lambda stage, percent: self._progress(job_id, stage, percent),
+                job_id=job_id
+            )
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+
+        if result.get("status") == "success":
+            for path in result.get("outputs", {}).values() or [result["video_path"]]:
+                try:
+                    # Looking a video up by job id yields the primary format
+                    self.outputs.register(path, job_id if path == result["video_path"] else None)
+                except OSError as e:
+                    print(f"Could not index {path}: {e}")
+            self._execute(
+                "UPDATE jobs SET status = 'succeeded', stage = 'done', progress = 100, result = ?, updated_at = ? "
+                "WHERE id = ?",
+                (json.dumps(result), time.time(), job_id),
+            )
+        else:
+            self._execute(
+                "UPDATE jobs SET status = 'failed', stage = 'error', result = ?, error = ?, updated_at = ? "
+                "WHERE id = ?",
+                (json.dumps(result), result.get("message"), time.time(), job_id),
+            )
+
+    def resume(self):
+        """
+        Re-queues jobs interrupted by a restart and schedules every queued job.
+        """
+        with self._lock:
+            running = self._db.execute(
+                "SELECT id, owner FROM jobs WHERE status = 'running'"
+            ).fetchall()
+        for row in running:
+            if not _owner_alive(row["owner"]):
+                self._execute(
+                    "UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0, updated_at = ? "
+                    "WHERE id = ? AND status = 'running'",
+                    (time.time(), row["id"]),
+                )
+
+        with self._lock:
+            queued = self._db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+            ).fetchall()
+        for row in queued:
+            self._executor.submit(self._run, row["id"])
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+video_jobs = VideoJobQueue()
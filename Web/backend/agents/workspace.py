@@ -0,0 +1,145 @@
+import os
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+
+# Total bytes allowed under OUTPUT_DIR before the oldest rendered videos are deleted.
+# cache/ is not counted: the clip, segment and TTS caches enforce their own limits.
+OUTPUT_DIR_QUOTA_BYTES = int(os.getenv("OUTPUT_DIR_QUOTA_BYTES", str(5 * 1024 ** 3)))
+# Rendered videos younger than this are never deleted for quota, so fresh downloads keep working
+OUTPUT_MIN_AGE = float(os.getenv("OUTPUT_MIN_AGE", str(24 * 3600)))
+# Workspaces older than this are treated as orphans of a crashed job
+WORKSPACE_MAX_AGE = float(os.getenv("WORKSPACE_MAX_AGE", str(6 * 3600)))
+WORKSPACE_SWEEP_INTERVAL = float(os.getenv("WORKSPACE_SWEEP_INTERVAL", "600"))
+
+_active = set()
+_active_lock = threading.Lock()
+
+
+@contextmanager
+def job_workspace(output_dir, job_id, keep=False):
+    """
+    Yields a private directory <output_dir>/temp/<job_id> for one job's
+    intermediate files and removes it afterwards, whether the job succeeded
+    or failed, unless `keep` is set.
+    """
+    path = os.path.join(output_dir, "temp", job_id)
+    os.makedirs(path, exist_ok=True)
+    with _active_lock:
+        _active.add(path)
+    try:
+        yield path
+    finally:
+        with _active_lock:
+            _active.discard(path)
+        if not keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def sweep(output_dir, quota_bytes=OUTPUT_DIR_QUOTA_BYTES, max_age=WORKSPACE_MAX_AGE, min_age=OUTPUT_MIN_AGE):
+    """
+    Removes stale workspaces and leftovers in <output_dir>/temp and old HLS
+    playlists in <output_dir>/hls, then deletes the oldest rendered videos
+    older than `min_age` until <output_dir>, excluding cache/, fits in
+    `quota_bytes`.
+    Returns the number of bytes freed.
+    """
+    freed = 0
+    cutoff = time.time() - max_age
+    with _active_lock:
+        active = set(_active)
+
+    # Progressive HLS copies are only needed while a job renders and shortly after
+    for name in ("temp", "hls"):
+        scratch_dir = os.path.join(output_dir, name)
+        if not os.path.isdir(scratch_dir):
+            continue
+        for entry in os.scandir(scratch_dir):
+            if entry.path in active:
+                continue
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if entry.is_dir():
+                    size = _tree_size(entry.path)
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                freed += size
+            except OSError:
+                pass
+
+    total = _tree_size(output_dir) - _tree_size(os.path.join(output_dir, "cache"))
+    if total > quota_bytes:
+        newest = time.time() - min_age
+        videos = sorted(
+            (
+                entry for entry in os.scandir(output_dir)
+                if entry.is_file() and entry.name.endswith(".mp4") and entry.stat().st_mtime < newest
+            ),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in videos:
+            if total <= quota_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= size
+            freed += size
+
+    return freed
+
+
+def evict_lru(directory, suffix, max_bytes, min_age):
+    """
+    Deletes the least recently modified `suffix` files in `directory` until
+    they fit in `max_bytes`. Files touched within `min_age` seconds and
+    partial (.part) files are kept. Callers refresh a file's mtime on use.
+    """
+    entries = [entry for entry in os.scandir(directory) if entry.name.endswith(suffix) and ".part" not in entry.name]
+    total = sum(entry.stat().st_size for entry in entries)
+    cutoff = time.time() - min_age
+    for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+        if total <= max_bytes or entry.stat().st_mtime >= cutoff:
+            break
+        try:
+            size = entry.stat().st_size
+            os.remove(entry.path)
+        except OSError:
+            continue
+        total -= size
+
+
+def start_sweeper(output_dir, interval=WORKSPACE_SWEEP_INTERVAL):
+    """
+    Runs sweep() on a daemon thread every `interval` seconds.
+    """
+    def loop():
+        while True:
+            try:
+                freed = sweep(output_dir)
+                if freed:
+                    print(f"🧹 Workspace sweeper freed {freed} bytes")
+            except Exception as e:
+                print(f"Workspace sweeper error: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="workspace-sweeper", daemon=True)
+    thread.start()
+    return thread
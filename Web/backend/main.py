@@ -1,16 +1,48 @@
 
-from fastapi import FastAPI, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from agents.financial_analysis import get_financial_insight, analyze_what_if_scenario
-from agents.video_generation_agent import generate_video
-from agents.operations_analysis import get_operations_insight
-from agents.marketing_analysis import get_marketing_insight, analyze_campaign_strategy, generate_campaign_suggestions
+from agents.financial_analysis import get_financial_insight_async, analyze_what_if_scenario_async, stream_financial_insight, analyze_what_if_batch_async
+from agents.financial_analysis import analyze_sensitivity_async
+from agents.scenario_analysis import RANK_FIELDS, WHAT_IF_MAX_SCENARIOS
+from agents.monte_carlo import MONTE_CARLO_DRAWS
+from agents.cashflow_analytics import cashflow_metrics, CASHFLOW_ROLLING_WINDOW, CASHFLOW_TOP_N
+from agents.video_jobs import video_jobs
+from agents.video_delivery import video_response, VIDEO_CACHE_CONTROL
+from agents.video_generation_agent import OUTPUT_DIR, HLS_DIR, OUTPUT_FORMATS, RENDER_PROFILES
+from agents.workspace import start_sweeper
+from agents.operations_analysis import get_operations_insight_async, stream_operations_insight
+from agents.marketing_analysis import get_marketing_insight_async, analyze_campaign_strategy_async, stream_marketing_insight, generate_campaign_suggestions
+from agents.llm_gateway import aclose as close_llm_clients, single_flight_stats
+from agents.response_cache import response_cache
+from agents.prompt_compaction import compaction_stats
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import json
+import asyncio
+import re
 
 app = FastAPI()
 
+
+@app.on_event("startup")
+async def resume_video_jobs():
+    """
+    Pick up video jobs that were queued or interrupted before a restart,
+    and start the sweeper that keeps OUTPUT_DIR within its disk quota.
+    """
+    video_jobs.resume()
+    start_sweeper(OUTPUT_DIR)
+
+
+@app.on_event("shutdown")
+async def shutdown_llm_clients():
+    """
+    Release the pooled LLM connections on shutdown.
+    """
+    await close_llm_clients()
+    video_jobs.shutdown()
+
 # CORS middleware to allow requests from the frontend
 app.add_middleware(
     CORSMiddleware,
@@ -24,10 +56,31 @@ class FinancialData(BaseModel):
     data: dict
     question: str
 
+class CashflowAnalyticsRequest(BaseModel):
+    data: dict
+    window: int = CASHFLOW_ROLLING_WINDOW
+    top_n: int = CASHFLOW_TOP_N
+
 class WhatIfData(BaseModel):
     original_data: dict
     modified_data: dict
 
+class WhatIfBatchData(BaseModel):
+    original_data: dict
+    scenarios: list[dict]
+    # Skip the narrative and return only the computed deltas
+    numbers_only: bool = False
+    rank_by: str = "profit"
+
+class SensitivityRequest(BaseModel):
+    original_data: dict
+    # Driver name ("revenue", "expenses" or an expenseBreakdown category) -> distribution spec
+    drivers: dict[str, dict]
+    draws: int = MONTE_CARLO_DRAWS
+    seed: int | None = None
+    # Also summarize the results with the LLM
+    narrative: bool = False
+
 class MarketingData(BaseModel):
     data: dict
     question: str
@@ -52,38 +105,134 @@ class OperationsData(BaseModel):
 
 class VideoGenerationRequest(BaseModel):
     brand_type: str
+    profile: str = "standard"
+    # Also publish an HLS playlist that can be played while the job renders
+    progressive: bool = False
+    # Aspect ratios to deliver, e.g. ["9:16", "1:1", "16:9"]; defaults to 9:16
+    formats: list[str] | None = None
+
+class PromoteVideoRequest(BaseModel):
+    profile: str = "final"
+
+class VideoPlanEdit(BaseModel):
+    captions: list[str] | None = None
+    voiceover: list[str] | None = None
+    cta: str | None = None
+
+
+def sse_response(tokens):
+    """
+    Wraps an async token generator as a Server-Sent-Events response.
+    Each token is sent as a `data:` event; a final `done` event closes the stream.
+    """
+    async def event_stream():
+        async for token in tokens:
+            yield f"data: {json.dumps({'token': token})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/generate-insight")
 async def generate_insight(request: FinancialData):
     """
     Endpoint to generate financial insight based on provided data and a question.
     """
-    insight = get_financial_insight(request.data, request.question)
+    insight = await get_financial_insight_async(request.data, request.question)
     return {"insight": insight}
 
+@app.post("/api/generate-insight/stream")
+async def generate_insight_stream(request: FinancialData):
+    """
+    Streaming variant of /api/generate-insight (Server-Sent Events).
+    """
+    return sse_response(stream_financial_insight(request.data, request.question))
+
+@app.post("/api/cashflow-analytics")
+async def cashflow_analytics(request: CashflowAnalyticsRequest):
+    """
+    Endpoint to compute cashflow metrics (rolling averages, growth, best/worst
+    months, break-even, runway) locally, without an LLM call.
+    """
+    if request.window < 1 or request.top_n < 1:
+        raise HTTPException(status_code=400, detail="window and top_n must be at least 1")
+    try:
+        metrics = cashflow_metrics(request.data, request.window, request.top_n)
+    except (TypeError, ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cashflowData: {e}")
+    if metrics is None:
+        raise HTTPException(status_code=400, detail="data.cashflowData has no rows")
+    return {"metrics": metrics}
+
 @app.post("/api/what-if-analysis")
 async def what_if_analysis(request: WhatIfData):
     """
     Endpoint to analyze a what-if scenario.
     """
-    analysis = analyze_what_if_scenario(request.original_data, request.modified_data)
+    analysis = await analyze_what_if_scenario_async(request.original_data, request.modified_data)
     return {"analysis": analysis}
 
+@app.post("/api/what-if-analysis/batch")
+async def what_if_analysis_batch(request: WhatIfBatchData):
+    """
+    Endpoint to evaluate many what-if scenarios at once. Deltas are computed
+    and ranked locally; the narrative is a single LLM call, or none with
+    `numbers_only`.
+    """
+    if not request.scenarios:
+        raise HTTPException(status_code=400, detail="At least one scenario is required")
+    if len(request.scenarios) > WHAT_IF_MAX_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"At most {WHAT_IF_MAX_SCENARIOS} scenarios per request")
+    if request.rank_by not in RANK_FIELDS:
+        raise HTTPException(status_code=400, detail=f"rank_by must be one of: {', '.join(RANK_FIELDS)}")
+    try:
+        return await analyze_what_if_batch_async(
+            request.original_data, request.scenarios, request.numbers_only, request.rank_by
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/what-if-analysis/sensitivity")
+async def what_if_sensitivity(request: SensitivityRequest):
+    """
+    Endpoint to run a Monte Carlo simulation of monthly profit under uncertain
+    revenue/expense drivers. Returns percentile bands, the probability of a
+    loss and tornado sensitivities, plus an optional narrative.
+    """
+    if not request.drivers:
+        raise HTTPException(status_code=400, detail="At least one driver is required")
+    try:
+        return await analyze_sensitivity_async(
+            request.original_data, request.drivers, request.draws, request.seed, request.narrative
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # Marketing AI Endpoints
 @app.post("/api/generate-marketing-insight")
 async def generate_marketing_insight(request: MarketingData):
     """
     Endpoint to generate marketing insight based on provided data and a question.
     """
-    insight = get_marketing_insight(request.data, request.question)
+    insight = await get_marketing_insight_async(request.data, request.question)
     return {"insight": insight}
 
+@app.post("/api/generate-marketing-insight/stream")
+async def generate_marketing_insight_stream(request: MarketingData):
+    """
+    Streaming variant of /api/generate-marketing-insight (Server-Sent Events).
+    """
+    return sse_response(stream_marketing_insight(request.data, request.question))
+
 @app.post("/api/analyze-campaign-strategy")
 async def analyze_campaign(request: CampaignData):
     """
     Endpoint to analyze campaign strategy and provide recommendations.
     """
-    analysis = analyze_campaign_strategy(request.campaign_data)
+    analysis = await analyze_campaign_strategy_async(request.campaign_data)
     return {"analysis": analysis}
 
 @app.post("/api/generate-campaign-suggestions")
@@ -250,41 +399,151 @@ async def generate_operations_insight(request: OperationsData):
     """
     Endpoint to generate operations insight based on provided data and a question.
     """
-    insight = get_operations_insight(request.data, request.question)
+    insight = await get_operations_insight_async(request.data, request.question)
     return {"insight": insight}
 
+@app.post("/api/generate-operations-insight/stream")
+async def generate_operations_insight_stream(request: OperationsData):
+    """
+    Streaming variant of /api/generate-operations-insight (Server-Sent Events).
+    """
+    return sse_response(stream_operations_insight(request.data, request.question))
+
 
 @app.post("/api/generate-marketing-video")
 async def generate_marketing_video(request: VideoGenerationRequest):
     """
-    Endpoint to generate a marketing video based on brand type.
+    Endpoint to queue a marketing video job based on brand type.
+    Returns a job id immediately; poll /api/video-jobs/{job_id} for progress.
+    With `progressive`, the reel can be played from `playlist_url` as it renders.
     """
-    result = generate_video(request.brand_type)
-    return result
-
-@app.get("/api/download-video/{video_name}")
-async def download_video(video_name: str):
+    if request.profile not in RENDER_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile. Choose one of: {', '.join(RENDER_PROFILES)}")
+    if request.formats is not None and (not request.formats or not set(request.formats) <= set(OUTPUT_FORMATS)):
+        raise HTTPException(status_code=400, detail=f"Unknown format. Choose from: {', '.join(OUTPUT_FORMATS)}")
+    params = {"brand_type": request.brand_type, "profile": request.profile}
+    if request.progressive:
+        params["progressive"] = True
+    if request.formats:
+        params["formats"] = list(dict.fromkeys(request.formats))
+    job_id = video_jobs.submit(params)
+    response = {"job_id": job_id, "status": "queued"}
+    if request.progressive:
+        response["playlist_url"] = f"/api/stream-video/{job_id}/index.m3u8"
+    return response
+
+@app.post("/api/video-jobs/{job_id}/promote")
+async def promote_video_job(job_id: str, request: PromoteVideoRequest):
     """
-    Endpoint to download a generated video.
+    Endpoint to re-render a finished (typically draft) job with another profile,
+    reusing its plan, clips and narration instead of starting over.
     """
-    # Try both paths: backend/marketing_videos (for running from project root)
-    # and marketing_videos (for running from backend directory or Docker)
-    video_paths = [
-        f"backend/marketing_videos/{video_name}",
-        f"marketing_videos/{video_name}",
-        f"/app/backend/marketing_videos/{video_name}",
-        f"/app/marketing_videos/{video_name}"
-    ]
-    
-    for video_path in video_paths:
-        if os.path.exists(video_path):
-            return FileResponse(
-                path=video_path,
-                media_type="video/mp4",
-                filename=video_name
-            )
-    
-    return {"error": "Video not found", "searched_paths": video_paths}
+    if request.profile not in RENDER_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile. Choose one of: {', '.join(RENDER_PROFILES)}")
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail="Only finished jobs can be promoted")
+    new_job_id = video_jobs.submit({
+        "brand_type": job["params"]["brand_type"],
+        "profile": request.profile,
+        "plan": job["result"]["plan"],
+        "video_files": job["result"].get("clips"),
+        "clip_size": job["result"].get("clip_size"),
+        "formats": job["params"].get("formats"),
+    })
+    return {"job_id": new_job_id, "status": "queued", "promoted_from": job_id}
+
+@app.patch("/api/video-jobs/{job_id}/plan")
+async def edit_video_plan(job_id: str, request: VideoPlanEdit):
+    """
+    Endpoint to edit the captions, voiceover or CTA of a finished job and
+    re-render it. Clips are reused and unchanged segments are spliced from the
+    segment cache, so only the edited segments are re-encoded.
+    """
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail="Only finished jobs can be edited")
+
+    plan = dict(job["result"]["plan"])
+    for field, value in request.model_dump(exclude_none=True).items():
+        if isinstance(value, list):
+            # Only the segments that were rendered need an entry; keep the rest as-is
+            plan[field] = value + plan[field][len(value):]
+        else:
+            plan[field] = value
+
+    new_job_id = video_jobs.submit({
+        "brand_type": job["params"]["brand_type"],
+        "profile": job["result"].get("profile", "standard"),
+        "plan": plan,
+        "video_files": job["result"].get("clips"),
+        "clip_size": job["result"].get("clip_size"),
+        "formats": job["params"].get("formats"),
+    })
+    return {"job_id": new_job_id, "status": "queued", "edited_from": job_id}
+
+@app.get("/api/video-jobs/{job_id}")
+async def get_video_job(job_id: str):
+    """
+    Endpoint to report the status, stage and progress percentage of a video job.
+    """
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "error": job["error"],
+    }
+
+@app.get("/api/video-jobs/{job_id}/result")
+async def get_video_job_result(job_id: str):
+    """
+    Endpoint to fetch the generate_video result of a finished job.
+    """
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["result"] is None:
+        return JSONResponse(status_code=202, content={"job_id": job["id"], "status": job["status"]})
+    return job["result"]
+
+@app.api_route("/api/download-video/{video_name}", methods=["GET", "HEAD"])
+async def download_video(video_name: str, request: Request):
+    """
+    Endpoint to download a generated video, by file name or job id.
+    Supports Range requests and conditional GETs so players can seek and
+    clients can revalidate without re-downloading.
+    """
+    entry = video_jobs.outputs.lookup(video_name)
+    if entry is None:
+        # Videos rendered before the output index existed
+        video_path = os.path.join(OUTPUT_DIR, os.path.basename(video_name))
+        if not video_name.endswith(".mp4") or not os.path.isfile(video_path):
+            raise HTTPException(status_code=404, detail="Video not found")
+        entry = await asyncio.to_thread(video_jobs.outputs.register, video_path)
+    return video_response(request, entry)
+
+@app.get("/api/stream-video/{job_id}/{file_name}")
+async def stream_video(job_id: str, file_name: str):
+    """
+    Endpoint to serve the progressive HLS playlist and segments of a video job.
+    The playlist grows while the job renders, so it must not be cached.
+    """
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id) or not re.fullmatch(r"index\.m3u8|seg_\d+\.ts", file_name):
+        raise HTTPException(status_code=404, detail="Stream not found")
+    path = os.path.join(HLS_DIR, job_id, file_name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Stream not found")
+    if file_name == "index.m3u8":
+        return FileResponse(path, media_type="application/vnd.apple.mpegurl", headers={"Cache-Control": "no-cache"})
+    return FileResponse(path, media_type="video/mp2t", headers={"Cache-Control": VIDEO_CACHE_CONTROL})
 
 @app.get("/api/get-bank-loan-rates")
 async def get_bank_loan_rates():
@@ -400,6 +659,19 @@ async def generate_campaign_suggestions(request: CampaignRequest):
     return {"suggestions": suggestions}
 
 
+@app.get("/api/cache-stats")
+async def cache_stats():
+    """
+    Hit/miss counters and occupancy of the LLM response cache, plus the
+    tokens saved by prompt compaction and the LLM calls collapsed by single-flight.
+    """
+    return {
+        **response_cache.stats(),
+        "prompt_compaction": compaction_stats(),
+        "single_flight": single_flight_stats(),
+    }
+
+
 @app.get("/health")
 async def health_check():
     """
@@ -8,6 +8,8 @@ import { Label } from "@/components/ui/label"
 import { Textarea } from "@/components/ui/textarea"
 import { Badge } from "@/components/ui/badge"
 import { useState } from "react"
+import { Zap, Play, Download, AlertCircle, CheckCircle } from "lucide-react"
+import { Alert, AlertDescription } from "@/components/ui/alert"
 
 type MarketingPlan = {
   search_terms: string[];
@@ -23,8 +25,16 @@ type VideoGenerationResponse = {
   plan?: MarketingPlan;
   message?: string;
 };
-import { Zap, Play, Download, AlertCircle, CheckCircle } from "lucide-react"
-import { Alert, AlertDescription } from "@/components/ui/alert"
+
+type VideoJobStatus = {
+  job_id: string;
+  status: string;
+  stage: string;
+  progress: number;
+  error?: string | null;
+};
+
+const JOB_POLL_INTERVAL_MS = 2000
 
 export function VideoGeneratorComponent() {
   const [brandType, setBrandType] = useState("")
@@ -44,14 +54,35 @@ export function VideoGeneratorComponent() {
     setStatus("Starting video generation...")
 
     try {
-      setStatus("Generating marketing plan...")
       const response = await fetch(API_ENDPOINTS.generateMarketingVideo(), {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ brand_type: brandType }),
       })
+      const submitted = await response.json().catch(() => null)
+      if (!response.ok) {
+        // FastAPI sends a string detail, or a list of validation errors
+        const detail = submitted?.detail
+        const message = typeof detail === "string"
+          ? detail
+          : Array.isArray(detail)
+            ? detail.map((item: { msg?: string }) => item.msg).filter(Boolean).join("; ")
+            : ""
+        setError(message || `Failed to start video generation (HTTP ${response.status})`)
+        setStatus("")
+        return
+      }
+      const jobId: string = submitted.job_id
+
+      // The backend renders in a job queue; poll until the job finishes
+      let job: VideoJobStatus
+      do {
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS))
+        job = await (await fetch(API_ENDPOINTS.videoJobStatus(jobId))).json()
+        setStatus(`Stage: ${job.stage} (${job.progress}%)`)
+      } while (job.status === "queued" || job.status === "running")
 
-      const result: VideoGenerationResponse = await response.json()
+      const result: VideoGenerationResponse = await (await fetch(API_ENDPOINTS.videoJobResult(jobId))).json()
 
       if (result.status === "success") {
         setStatus("Video generated successfully!")
@@ -16,17 +16,26 @@ export const getBackendUrl = (): string => {
 export const API_ENDPOINTS = {
   // Financial endpoints
   generateInsight: () => `${getBackendUrl()}/api/generate-insight`,
+  generateInsightStream: () => `${getBackendUrl()}/api/generate-insight/stream`,
   whatIfAnalysis: () => `${getBackendUrl()}/api/what-if-analysis`,
+  whatIfAnalysisBatch: () => `${getBackendUrl()}/api/what-if-analysis/batch`,
+  whatIfSensitivity: () => `${getBackendUrl()}/api/what-if-analysis/sensitivity`,
+  cashflowAnalytics: () => `${getBackendUrl()}/api/cashflow-analytics`,
   
   // Marketing endpoints
   generateMarketingInsight: () => `${getBackendUrl()}/api/generate-marketing-insight`,
+  generateMarketingInsightStream: () => `${getBackendUrl()}/api/generate-marketing-insight/stream`,
   analyzeCampaignStrategy: () => `${getBackendUrl()}/api/analyze-campaign-strategy`,
   generateCampaignSuggestions: () => `${getBackendUrl()}/api/generate-campaign-suggestions`,
   generateMarketingVideo: () => `${getBackendUrl()}/api/generate-marketing-video`,
+  videoJobStatus: (jobId: string) => `${getBackendUrl()}/api/video-jobs/${jobId}`,
+  videoJobResult: (jobId: string) => `${getBackendUrl()}/api/video-jobs/${jobId}/result`,
+  videoStream: (jobId: string) => `${getBackendUrl()}/api/stream-video/${jobId}/index.m3u8`,
   downloadVideo: (videoName: string) => `${getBackendUrl()}/api/download-video/${videoName}`,
   
   // Operations endpoints
   generateOperationsInsight: () => `${getBackendUrl()}/api/generate-operations-insight`,
+  generateOperationsInsightStream: () => `${getBackendUrl()}/api/generate-operations-insight/stream`,
   handleAlert: () => `${getBackendUrl()}/api/handle-alert`,
   
   // Loan endpoints